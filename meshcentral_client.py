@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Asyncio MeshCentral client with request correlation and a bulk scripting CLI
+
+Every request carries a unique responseid and its reply is routed back to
+the waiting coroutine, so any number of commands can be in flight on one
+control.ashx connection. The device registry is kept live from 'nodes',
+'meshes' and device events.
+
+Library use:
+    async with MeshCentralClient(url, username, password) as client:
+        devices = client.select('os:ubuntu state:online')
+        result = await client.run_command(devices[0]['id'], 'uptime')
+
+Bulk CLI (one command per line in the script file, '#' comments allowed):
+    python meshcentral_client.py --script cmds.txt --select 'mesh:swarm os:ubuntu' --parallel 20
+
+Selectors use the same grammar as the proxy's selector parameter, parsed by
+proxy/device_selector.py.
+"""
+
+import aiohttp
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'proxy'))
+from device_selector import DeviceIndex, parse_selector  # noqa: E402
+
+COMMAND_TYPES = {'shell': 0, 'cmd': 1, 'powershell': 2}
+
+logger = logging.getLogger(__name__)
+
+
+class MeshCentralClient:
+    """Async MeshCentral WebSocket client authenticated with x-meshauth"""
+
+    def __init__(self, url: str, username: str, password: str, token: str = "",
+                 ssl: Any = None, default_timeout: float = 60.0):
+        self.url = url if url.startswith(('wss://', 'ws://')) else f'wss://{url}/control.ashx'
+        self.username = username
+        self.password = password
+        self.token = token  # 2FA token if enabled, empty otherwise
+        self.ssl = ssl
+        self.default_timeout = default_timeout
+        self.authenticated = False
+        self.devices: Dict[str, Dict[str, Any]] = {}
+        self.meshes: Dict[str, str] = {}
+        self.close_cause: Optional[str] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._ready: Optional[asyncio.Event] = None
+
+    def _create_auth_header(self) -> str:
+        """Create x-meshauth header: base64 username,password[,token]"""
+        parts = [self.username, self.password] + ([self.token] if self.token else [])
+        return ','.join(base64.b64encode(part.encode()).decode() for part in parts)
+
+    async def connect(self, timeout: float = 10.0) -> bool:
+        """Open the connection and wait for the first device list"""
+        self._ready = asyncio.Event()
+        self._session = aiohttp.ClientSession()
+        self._ws = await self._session.ws_connect(
+            self.url,
+            headers={'x-meshauth': self._create_auth_header()},
+            heartbeat=30,
+            max_msg_size=0,
+            ssl=self.ssl
+        )
+        self._reader_task = asyncio.create_task(self._reader())
+        await self._send({'action': 'meshes'})
+        await self._send({'action': 'nodes'})
+
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.authenticated
+
+    async def close(self):
+        """Close the connection and fail any outstanding requests"""
+        if self._ws is not None:
+            await self._ws.close()
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        try:
+            connected = await self.connect()
+        except BaseException:
+            await self.close()
+            raise
+        if not connected:
+            await self.close()
+            raise ConnectionError(f"MeshCentral authentication failed: {self.close_cause or 'timeout'}")
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _send(self, data: Dict[str, Any]):
+        await self._ws.send_str(json.dumps(data))
+
+    async def _reader(self):
+        """Dispatch incoming messages until the socket closes"""
+        try:
+            async for message in self._ws:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    try:
+                        self._handle(json.loads(message.data))
+                    except json.JSONDecodeError:
+                        continue
+                    except Exception as e:
+                        # One bad message must not stop replies to everything else
+                        logger.error(f"Error handling MeshCentral message: {e!r}")
+                elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    break
+        finally:
+            self.authenticated = False
+            self._ready.set()
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("MeshCentral connection closed"))
+            self._pending.clear()
+
+    def _handle(self, data: Dict[str, Any]):
+        # Route replies first, so a reply still arrives if the registry update below fails
+        future = self._pending.get(data.get('responseid'))
+        if future is not None and not future.done():
+            future.set_result(data)
+
+        action = data.get('action')
+
+        if action == 'nodes' and 'nodes' in data:
+            devices = {}
+            for mesh_id, nodes in data['nodes'].items():
+                for node in nodes if isinstance(nodes, list) else []:
+                    if not isinstance(node, dict) or not node.get('_id'):
+                        continue
+                    node.setdefault('meshid', mesh_id)
+                    devices[node['_id']] = node
+            self.devices = devices
+            self.authenticated = True
+            self._ready.set()
+
+        elif action == 'meshes' and 'meshes' in data:
+            self.meshes = {
+                mesh['_id']: mesh.get('name', '')
+                for mesh in data['meshes'] if isinstance(mesh, dict) and mesh.get('_id')
+            }
+
+        elif action == 'close':
+            self.close_cause = data.get('cause', 'unknown')
+            self.authenticated = False
+            self._ready.set()
+
+        elif action == 'event':
+            self._handle_event(data.get('event', {}))
+
+    def _handle_event(self, event: Dict[str, Any]):
+        """Keep the device registry in step with device events"""
+        event_action = event.get('action')
+        node_id = event.get('nodeid')
+
+        if event_action in ('addnode', 'changenode') and isinstance(event.get('node'), dict):
+            node = dict(self.devices.get(node_id, {}), **event['node'])
+            if node.get('_id', node_id):
+                self.devices[node.get('_id', node_id)] = node
+        elif event_action == 'removenode':
+            self.devices.pop(node_id, None)
+        elif event_action == 'nodeconnect' and node_id in self.devices:
+            self.devices[node_id]['conn'] = event.get('conn', 0)
+        elif event_action in ('createmesh', 'meshchange') and event.get('meshid'):
+            self.meshes[event['meshid']] = event.get('name', self.meshes.get(event['meshid'], ''))
+
+    async def request(self, data: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Send a message and wait for the reply carrying its responseid"""
+        msg_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[msg_id] = future
+        try:
+            await self._send(dict(data, responseid=msg_id))
+            return await asyncio.wait_for(future, timeout or self.default_timeout)
+        finally:
+            self._pending.pop(msg_id, None)
+
+    async def run_command(self, node_id: str, command: str, shell: str = 'shell',
+                          run_as_user: int = 0, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Run a command on one device and return the runcommands reply"""
+        return await self.request({
+            'action': 'runcommands',
+            'nodeids': [node_id],
+            'type': COMMAND_TYPES[shell],
+            'cmds': command,
+            'runAsUser': run_as_user,
+            'reply': True
+        }, timeout)
+
+    def list_devices(self) -> List[Dict[str, Any]]:
+        """Devices in the same simple format as the proxy's /getDevices"""
+        return [
+            {
+                'id': node_id,
+                'name': node.get('name', 'Unknown'),
+                'online': (node.get('conn', 0) & 1) != 0,
+                'os': node.get('osdesc', 'Unknown OS'),
+                'ip': node.get('ip', 'N/A'),
+                'mesh': self.meshes.get(node.get('meshid'), node.get('meshid'))
+            }
+            for node_id, node in self.devices.items()
+        ]
+
+    def select(self, *selectors: str) -> List[Dict[str, Any]]:
+        """Devices matching any of the selectors, or all devices if none are given"""
+        if not selectors:
+            return self.list_devices()
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for node in self.devices.values():
+            grouped.setdefault(node.get('meshid', ''), []).append(node)
+        index = DeviceIndex()
+        index.rebuild(grouped, self.meshes)
+        selected = set().union(*(index.resolve(selector) for selector in selectors))
+        return [device for device in self.list_devices() if device['id'] in selected]
+
+
+def load_script(path: str) -> List[str]:
+    """Commands from a script file, one per line"""
+    with open(path, 'r') as f:
+        return [line.rstrip('\n') for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+async def run_script(client: MeshCentralClient, devices: List[Dict[str, Any]], commands: List[str],
+                     parallel: int, shell: str, timeout: float, stop_on_error: bool, out=sys.stdout) -> Dict[str, int]:
+    """Run the commands in order on each device, with devices in parallel"""
+    semaphore = asyncio.Semaphore(parallel)
+    totals = {'ok': 0, 'failed': 0}
+
+    async def run_device(device):
+        async with semaphore:
+            for command in commands:
+                started = time.monotonic()
+                record = {'device_id': device['id'], 'name': device['name'], 'command': command}
+                try:
+                    reply = await client.run_command(device['id'], command, shell=shell, timeout=timeout)
+                    record.update(success=True, output=reply.get('result', reply.get('value', '')))
+                    totals['ok'] += 1
+                except (asyncio.TimeoutError, ConnectionError) as e:
+                    record.update(success=False, error=type(e).__name__)
+                    totals['failed'] += 1
+                record['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+                if stop_on_error and not record['success']:
+                    return
+
+    await asyncio.gather(*(run_device(device) for device in devices))
+    return totals
+
+
+async def _main(args) -> int:
+    commands = load_script(args.script)
+    async with MeshCentralClient(args.url, args.username, args.password, args.token,
+                                 default_timeout=args.timeout) as client:
+        devices = client.select(*args.select)
+        if not args.include_offline:
+            devices = [device for device in devices if device['online']]
+        print(f"{len(devices)} devices selected, {len(commands)} commands each", file=sys.stderr)
+
+        started = time.monotonic()
+        totals = await run_script(client, devices, commands, args.parallel, args.shell,
+                                  args.timeout, args.stop_on_error)
+        print(f"{totals['ok']} ok, {totals['failed']} failed in {time.monotonic() - started:.1f}s",
+              file=sys.stderr)
+        return 0 if totals['failed'] == 0 else 1
+
+
+def main(argv: Optional[List[str]] = None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Run a command script across MeshCentral devices")
+    parser.add_argument('--url', default=os.getenv('DAISYCHAIN_URL', 'tee.up.railway.app'))
+    parser.add_argument('--username', default=os.getenv('MESHCENTRAL_USERNAME'))
+    parser.add_argument('--password', default=os.getenv('MESHCENTRAL_PASSWORD'))
+    parser.add_argument('--token', default=os.getenv('MESHCENTRAL_TOKEN', ''), help="2FA token")
+    parser.add_argument('--script', required=True, help="File with one command per line")
+    parser.add_argument('--select', action='append', default=[],
+                        help="Device selector, e.g. 'mesh:swarm os:ubuntu -tag:maintenance'; "
+                             "repeat to add more, omit for all devices")
+    parser.add_argument('--parallel', type=int, default=10, help="Devices worked on at once")
+    parser.add_argument('--shell', choices=sorted(COMMAND_TYPES), default='shell')
+    parser.add_argument('--timeout', type=float, default=60.0, help="Seconds per command")
+    parser.add_argument('--include-offline', action='store_true')
+    parser.add_argument('--stop-on-error', action='store_true', help="Skip a device's remaining commands after a failure")
+    args = parser.parse_args(argv)
+
+    if not args.username or not args.password:
+        parser.error("MESHCENTRAL_USERNAME and MESHCENTRAL_PASSWORD (or --username/--password) are required")
+    try:
+        for selector in args.select:
+            parse_selector(selector)
+    except ValueError as e:
+        parser.error(str(e))
+
+    sys.exit(asyncio.run(_main(args)))
+
+
+if __name__ == '__main__':
+    main()
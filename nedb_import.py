@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Streaming, resumable importer for NeDB/JSONL exports into MeshCentral's MongoDB
+
+Records are read lazily and sent as unordered batches of upserts keyed on _id,
+so re-running an import is safe and duplicate keys no longer abort it.
+Progress is checkpointed per source file, and a rerun resumes after the last
+record that was fully written.
+
+Records without an _id are plain inserts and are not idempotent: a resume
+re-sends everything after the checkpoint, so such records that were already
+written past it end up in the collection twice. NeDB datafiles always carry
+an _id; this only affects other JSON exports.
+
+The import functions accept any object with a pymongo-compatible bulk_write(),
+so they can run against a local mongod or an in-memory stand-in such as
+mongomock.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    from pymongo import MongoClient, ReplaceOne, InsertOne, DeleteOne
+    from pymongo.errors import BulkWriteError
+except ImportError:
+    MongoClient = None
+
+# MongoDB connection details, e.g. the Railway MONGO_URL; never hardcode credentials
+MONGO_URL = os.getenv('MONGO_URL')
+DB_NAME = os.getenv('MONGO_DB', "meshcentral")
+COLLECTION_NAME = os.getenv('MONGO_COLLECTION', "meshcentral")
+
+DEFAULT_FILES = ['user-export.json', 'mesh-export.json']
+DEFAULT_CHECKPOINT = '.nedb-import-checkpoint.json'
+
+READ_CHUNK_SIZE = 1 << 20
+WHITESPACE = re.compile(r'\s*')
+
+
+def iter_documents(path: str, skip: int = 0) -> Iterator[Dict[str, Any]]:
+    """Yield JSON documents from a file without loading it whole
+
+    Handles JSONL (NeDB datafiles and mesh-export.json), concatenated or
+    pretty-printed objects (user-export.json) and top-level arrays. NeDB
+    index definition lines are skipped. The first `skip` documents are
+    parsed and dropped, which is how a resumed import catches up.
+    """
+    decoder = json.JSONDecoder()
+    count = 0
+    buffer = ''
+    pos = 0
+    eof = False
+
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if pos >= len(buffer):
+                if eof:
+                    return
+                buffer = f.read(READ_CHUNK_SIZE)
+                pos = 0
+                eof = not buffer
+                continue
+
+            try:
+                value, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Incomplete document at the end of the buffer, read more
+                chunk = f.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+
+            for doc in (value if isinstance(value, list) else [value]):
+                if not isinstance(doc, dict) or '$$indexCreated' in doc:
+                    continue
+                count += 1
+                if count > skip:
+                    yield doc
+
+
+def to_operation(doc: Dict[str, Any]):
+    """Map a NeDB record to a bulk write operation
+
+    Idempotent for records with an _id. Records without one become an
+    InsertOne, which a rerun or resume repeats (see the module docstring).
+    """
+    if doc.get('$$deleted') and '_id' in doc:
+        return DeleteOne({'_id': doc['_id']})
+    if '_id' in doc:
+        return ReplaceOne({'_id': doc['_id']}, doc, upsert=True)
+    return InsertOne(doc)
+
+
+def last_per_id(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop all but the last record for each _id in a batch
+
+    An unordered bulk write does not apply operations in order (pymongo
+    groups them by type: inserts, then replaces, then deletes), so NeDB's
+    "replaced, deleted, re-added" would end deleted. Every operation
+    replaces or deletes the whole document, so the last record alone gives
+    the same result. Records without an _id are all kept.
+    """
+    latest: Dict[Any, Dict[str, Any]] = {}
+    without_id = []
+    for doc in docs:
+        if '_id' in doc:
+            latest.pop(doc['_id'], None)
+            latest[doc['_id']] = doc
+        else:
+            without_id.append(doc)
+    return list(latest.values()) + without_id
+
+
+def partition_for(doc: Dict[str, Any], partitions: int) -> int:
+    """Route all records for one _id to the same writer so they stay ordered"""
+    if partitions == 1:
+        return 0
+    return zlib.crc32(str(doc.get('_id', '')).encode()) % partitions
+
+
+class ImportStats:
+    """Thread-safe counters and throughput reporting for an import run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.read = 0
+        self.written = 0
+        self.upserted = 0
+        self.modified = 0
+        self.deleted = 0
+        self.errors = 0
+        self.batches = 0
+
+    def add_result(self, ops: int, result=None, errors: int = 0):
+        with self._lock:
+            self.batches += 1
+            self.written += ops
+            self.errors += errors
+            if result is not None:
+                self.upserted += getattr(result, 'upserted_count', 0) + getattr(result, 'inserted_count', 0)
+                self.modified += getattr(result, 'modified_count', 0)
+                self.deleted += getattr(result, 'deleted_count', 0)
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'read': self.read,
+                'written': self.written,
+                'upserted': self.upserted,
+                'modified': self.modified,
+                'deleted': self.deleted,
+                'errors': self.errors,
+                'batches': self.batches,
+                'seconds': round(time.monotonic() - self.started, 2),
+                'records_per_second': round(self.rate(), 1)
+            }
+
+
+class Checkpoint:
+    """Per-file record offsets, written atomically after progress is made"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.state: Dict[str, Dict[str, Any]] = {}
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.state = json.load(f)
+
+    def resume_point(self, source: str) -> int:
+        """Number of records of source already imported, 0 if it changed"""
+        entry = self.state.get(os.path.abspath(source))
+        if not entry:
+            return 0
+        if os.path.getsize(source) < entry.get('size', 0):
+            print(f"{source} is smaller than at the last checkpoint, starting over")
+            return 0
+        return entry.get('records', 0)
+
+    def save(self, source: str, records: int):
+        if not self.path:
+            return
+        self.state[os.path.abspath(source)] = {
+            'records': records,
+            'size': os.path.getsize(source),
+            'updated': time.time()
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _write_batch(collection, docs: List[Dict[str, Any]], stats: ImportStats):
+    """Send one unordered bulk write; per-document errors are counted, not fatal"""
+    ops = [to_operation(doc) for doc in last_per_id(docs)]
+    try:
+        result = collection.bulk_write(ops, ordered=False)
+        stats.add_result(len(docs), result)
+    except BulkWriteError as e:
+        write_errors = e.details.get('writeErrors', [])
+        for error in write_errors[:5]:
+            print(f"  Write error on {error.get('op', {}).get('_id', '?')}: {error.get('errmsg')}")
+        stats.add_result(len(docs), errors=len(write_errors))
+
+
+def import_file(collection, path: str, batch_size: int = 1000, workers: int = 1,
+                checkpoint: Optional[Checkpoint] = None, stats: Optional[ImportStats] = None,
+                progress_every: float = 5.0) -> ImportStats:
+    """Stream one file into a collection
+
+    With workers > 1, records are partitioned by _id across that many
+    single-threaded writers, so several batches are in flight while updates
+    to the same _id still apply in file order: batches of one partition are
+    written one after another, and within a batch only the last record per
+    _id is sent (see last_per_id).
+    """
+    stats = stats or ImportStats()
+    checkpoint = checkpoint or Checkpoint(None)
+    skip = checkpoint.resume_point(path)
+    if skip:
+        print(f"Resuming {path} after {skip} records")
+
+    writers = [ThreadPoolExecutor(max_workers=1) for _ in range(workers)]
+    buffers: List[List[Dict[str, Any]]] = [[] for _ in range(workers)]
+    buffer_start: List[Optional[int]] = [None] * workers
+    outstanding: Dict[Future, int] = {}
+    # Bounds memory: the reader blocks once this many batches are in flight
+    slots = threading.BoundedSemaphore(workers * 2)
+    lock = threading.Lock()
+    failures: List[BaseException] = []
+    # Start offsets of batches that raised; the checkpoint never passes them
+    failed_starts: List[int] = []
+
+    def done(future: Future):
+        with lock:
+            start = outstanding.pop(future, None)
+            if future.exception() is not None:
+                failed_starts.append(start)
+                failures.append(future.exception())
+        slots.release()
+
+    def submit(partition: int):
+        slots.acquire()
+        docs = buffers[partition]
+        future = writers[partition].submit(_write_batch, collection, docs, stats)
+        with lock:
+            outstanding[future] = buffer_start[partition]
+        buffers[partition] = []
+        buffer_start[partition] = None
+        future.add_done_callback(done)
+
+    def safe_offset(read_through: int) -> int:
+        """Records before the first one not yet written"""
+        with lock:
+            pending = list(outstanding.values()) + failed_starts
+        pending += [start for start in buffer_start if start is not None]
+        return min(pending) if pending else read_through
+
+    index = skip
+    last_report = time.monotonic()
+    try:
+        for doc in iter_documents(path, skip=skip):
+            partition = partition_for(doc, workers)
+            if buffer_start[partition] is None:
+                buffer_start[partition] = index
+            buffers[partition].append(doc)
+            index += 1
+            stats.read += 1
+
+            if len(buffers[partition]) >= batch_size:
+                submit(partition)
+
+            if failures:
+                raise failures[0]
+
+            now = time.monotonic()
+            if now - last_report >= progress_every:
+                last_report = now
+                checkpoint.save(path, safe_offset(index))
+                print(f"  {path}: {index} records read, {stats.written} written "
+                      f"({stats.rate():.0f} records/s)")
+
+        for partition in range(workers):
+            if buffers[partition]:
+                submit(partition)
+    finally:
+        for writer in writers:
+            writer.shutdown(wait=True)
+
+    if failures:
+        checkpoint.save(path, safe_offset(index))
+        raise failures[0]
+
+    checkpoint.save(path, index)
+    return stats
+
+
+def import_files(collection, paths: List[str], batch_size: int = 1000, workers: int = 1,
+                 checkpoint_path: Optional[str] = DEFAULT_CHECKPOINT,
+                 progress_every: float = 5.0) -> ImportStats:
+    """Stream several files into a collection, sharing one set of stats"""
+    checkpoint = Checkpoint(checkpoint_path)
+    stats = ImportStats()
+    for path in paths:
+        print(f"\nImporting {path}...")
+        import_file(collection, path, batch_size=batch_size, workers=workers,
+                    checkpoint=checkpoint, stats=stats, progress_every=progress_every)
+    return stats
+
+
+def count_by_type(collection) -> List[Tuple[str, int]]:
+    """Document counts per NeDB record type"""
+    return [
+        (row['_id'], row['count'])
+        for row in collection.aggregate([{'$group': {'_id': '$type', 'count': {'$sum': 1}}}])
+    ]
+
+
+def main(argv: Optional[List[str]] = None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Stream NeDB/JSONL exports into MongoDB")
+    parser.add_argument('files', nargs='*', default=DEFAULT_FILES,
+                        help="NeDB datafiles or JSON/JSONL exports (default: %(default)s)")
+    parser.add_argument('--mongo-url', default=MONGO_URL, help="MongoDB connection string (default: $MONGO_URL)")
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--collection', default=COLLECTION_NAME)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Parallel writers, records are partitioned by _id")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                        help="Progress file used to resume (default: %(default)s)")
+    parser.add_argument('--restart', action='store_true', help="Ignore and overwrite the checkpoint")
+    parser.add_argument('--progress-every', type=float, default=5.0, help="Seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    if not args.mongo_url:
+        parser.error("Set MONGO_URL or pass --mongo-url")
+
+    if MongoClient is None:
+        print("pymongo not installed. Install with: pip install pymongo")
+        sys.exit(1)
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    print("Connecting to MongoDB...")
+    print(f"Database: {args.db}")
+    print(f"Collection: {args.collection}")
+
+    client = MongoClient(args.mongo_url)
+    try:
+        client.admin.command('ping')
+        print("Connected successfully!")
+        collection = client[args.db][args.collection]
+
+        stats = import_files(collection, args.files, batch_size=args.batch_size, workers=args.workers,
+                             checkpoint_path=args.checkpoint, progress_every=args.progress_every)
+
+        summary = stats.summary()
+        print(f"\nImported {summary['written']} records in {summary['seconds']}s "
+              f"({summary['records_per_second']} records/s)")
+        print(f"Upserted: {summary['upserted']}, modified: {summary['modified']}, "
+              f"deleted: {summary['deleted']}, errors: {summary['errors']}")
+
+        print("\nDocuments in collection by type:")
+        for doc_type, count in count_by_type(collection):
+            print(f"  {doc_type}: {count}")
+        print("\nRun verify_mongodb_import.py with the same files to compare content")
+
+        if summary['errors']:
+            sys.exit(2)
+    except Exception as e:
+        print(f"Error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Concurrent endpoint probe for MeshCentral and proxy deployments
+
+Combines check_cert.py, check_redirects.py and check_nginx.py into one async
+run over many targets:
+- TLS certificate expiry, issuer and SANs (non-blocking handshake)
+- Redirect chain starting from http://, including loop detection
+- The ':443' path issue (port number leaking into redirect paths)
+
+All HTTP probes share one pooled connector. Each probe has its own timeout,
+and the results are written as a JSON report.
+
+Usage:
+    python probe_endpoints.py tee.up.railway.app proxy.example.com:8443
+    python probe_endpoints.py --file targets.txt --concurrency 100 --output report.json
+"""
+
+import aiohttp
+import argparse
+import asyncio
+import datetime
+import json
+import ssl
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+
+def parse_target(target: str) -> Tuple[str, int]:
+    """Accept 'host', 'host:port' or a URL and return (host, https port)"""
+    if '://' not in target:
+        target = f"https://{target}"
+    parts = urlsplit(target)
+    # An http:// target is still probed for TLS on the default port
+    port = parts.port if parts.port and parts.scheme == 'https' else 443
+    return parts.hostname, port
+
+
+def load_targets(args_targets: List[str], path: Optional[str]) -> List[str]:
+    """Targets from the command line plus a file with one per line"""
+    targets = list(args_targets)
+    if path:
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    targets.append(line)
+    # Keep order, drop duplicates
+    return list(dict.fromkeys(targets))
+
+
+def _name(entries) -> Dict[str, str]:
+    return {key: value for entry in entries for key, value in entry}
+
+
+async def probe_certificate(host: str, port: int, warn_days: int) -> Dict[str, Any]:
+    """TLS handshake on the event loop and certificate summary"""
+    context = ssl.create_default_context()
+    result: Dict[str, Any] = {'ok': False}
+    writer = None
+    try:
+        _, writer = await asyncio.open_connection(host, port, ssl=context, server_hostname=host)
+        cert = writer.get_extra_info('peercert')
+        cipher = writer.get_extra_info('cipher')
+
+        not_after = datetime.datetime.fromtimestamp(ssl.cert_time_to_seconds(cert['notAfter']), datetime.timezone.utc)
+        days_left = (not_after - datetime.datetime.now(datetime.timezone.utc)).total_seconds() / 86400
+
+        result.update({
+            'issued_to': _name(cert.get('subject', ())).get('commonName', 'N/A'),
+            'issued_by': _name(cert.get('issuer', ())).get('commonName', 'N/A'),
+            'valid_from': cert.get('notBefore'),
+            'valid_until': cert.get('notAfter'),
+            'days_remaining': round(days_left, 1),
+            'sans': [name for _, name in cert.get('subjectAltName', ())],
+            'tls_version': cipher[1] if cipher else None,
+            'expiring': days_left < warn_days,
+        })
+        result['ok'] = not result['expiring']
+    except ssl.SSLCertVerificationError as e:
+        result['error'] = f"Certificate verification failed: {e.verify_message}"
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if writer is not None:
+            writer.close()
+    return result
+
+
+async def probe_redirects(session: aiohttp.ClientSession, url: str, max_redirects: int) -> Dict[str, Any]:
+    """Follow a redirect chain by hand so every hop is recorded"""
+    chain = []
+    seen = set()
+    current_url = url
+    result: Dict[str, Any] = {'ok': False, 'chain': chain}
+
+    try:
+        for _ in range(max_redirects + 1):
+            if current_url in seen:
+                result['error'] = f"Redirect loop at {current_url}"
+                return result
+            seen.add(current_url)
+
+            async with session.get(current_url, allow_redirects=False, ssl=False) as response:
+                location = response.headers.get('Location')
+                chain.append({'url': current_url, 'status': response.status, 'location': location})
+
+                if not 300 <= response.status < 400:
+                    result['final_url'] = current_url
+                    result['final_status'] = response.status
+                    result['ok'] = response.status < 400
+                    break
+                if not location:
+                    result['error'] = f"HTTP {response.status} without Location header"
+                    return result
+                # Relative Location headers resolve against the current URL
+                current_url = urljoin(current_url, location)
+        else:
+            result['error'] = f"More than {max_redirects} redirects"
+            return result
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        return result
+
+    result['port_in_path'] = any(':443' in urlsplit(hop['url']).path for hop in chain)
+    result['ends_on_https'] = result.get('final_url', '').startswith('https://')
+    if result['port_in_path']:
+        result['ok'] = False
+    return result
+
+
+async def probe_port_path(session: aiohttp.ClientSession, host: str, port: int) -> Dict[str, Any]:
+    """Check whether the server redirects into a path containing ':443'"""
+    url = f"https://{host}:{port}/:443/"
+    result: Dict[str, Any] = {'ok': False, 'url': url}
+    try:
+        async with session.get(url, allow_redirects=False, ssl=False) as response:
+            location = response.headers.get('Location') or ''
+            result['status'] = response.status
+            result['location'] = location or None
+            # Bouncing /:443/ to another :443 path is the nginx misconfiguration
+            result['ok'] = not (300 <= response.status < 400 and ':443' in urlsplit(urljoin(url, location)).path)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def probe_target(target: str, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore,
+                       timeout: float, warn_days: int, max_redirects: int) -> Dict[str, Any]:
+    """Run all probes for one target concurrently"""
+    host, port = parse_target(target)
+    # Non-default ports only speak TLS, so their chain starts at https://
+    start_url = f"http://{host}/" if port == 443 else f"https://{host}:{port}/"
+
+    async with semaphore:
+        started = time.monotonic()
+
+        async def bounded(name, coro):
+            try:
+                return await asyncio.wait_for(coro, timeout)
+            except asyncio.TimeoutError:
+                return {'ok': False, 'error': f"{name} probe timed out after {timeout}s"}
+
+        certificate, redirects, port_path = await asyncio.gather(
+            bounded('certificate', probe_certificate(host, port, warn_days)),
+            bounded('redirect', probe_redirects(session, start_url, max_redirects)),
+            bounded('port path', probe_port_path(session, host, port)),
+        )
+
+    issues = []
+    if certificate.get('error'):
+        issues.append(certificate['error'])
+    elif certificate.get('expiring'):
+        issues.append(f"Certificate expires in {certificate['days_remaining']} days")
+    if redirects.get('error'):
+        issues.append(redirects['error'])
+    elif redirects.get('port_in_path'):
+        issues.append("Redirect chain puts ':443' in the path")
+    if port_path.get('error'):
+        issues.append(port_path['error'])
+    elif not port_path.get('ok'):
+        issues.append(f"/:443/ redirects to {port_path.get('location')}")
+
+    return {
+        'target': target,
+        'host': host,
+        'port': port,
+        'ok': not issues,
+        'issues': issues,
+        'certificate': certificate,
+        'redirects': redirects,
+        'port_path': port_path,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1)
+    }
+
+
+async def probe_all(targets: List[str], concurrency: int = 50, timeout: float = 10.0,
+                    warn_days: int = 14, max_redirects: int = 10) -> Dict[str, Any]:
+    """Probe every target and build the report"""
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency * 2, limit_per_host=4, ttl_dns_cache=300)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        results = await asyncio.gather(*(
+            probe_target(target, session, semaphore, timeout, warn_days, max_redirects)
+            for target in targets
+        ))
+
+    return {
+        'generated': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'summary': {
+            'targets': len(results),
+            'ok': sum(1 for r in results if r['ok']),
+            'failed': sum(1 for r in results if not r['ok']),
+            'seconds': round(time.monotonic() - started, 2)
+        },
+        'results': results
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Probe TLS, redirects and the :443 path issue across endpoints")
+    parser.add_argument('targets', nargs='*', help="host, host:port or https:// URL")
+    parser.add_argument('--file', help="File with one target per line ('#' starts a comment)")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=10.0, help="Seconds per probe")
+    parser.add_argument('--warn-days', type=int, default=14, help="Flag certificates expiring sooner")
+    parser.add_argument('--max-redirects', type=int, default=10)
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    targets = load_targets(args.targets, args.file)
+    if not targets:
+        parser.error("no targets given")
+
+    report = asyncio.run(probe_all(targets, args.concurrency, args.timeout, args.warn_days, args.max_redirects))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    summary = report['summary']
+    print(f"{summary['ok']}/{summary['targets']} targets OK in {summary['seconds']}s", file=sys.stderr)
+    for result in report['results']:
+        for issue in result['issues']:
+            print(f"  {result['target']}: {issue}", file=sys.stderr)
+
+    sys.exit(0 if summary['failed'] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 """
-Simple MeshCentral Proxy API with 3 main routes:
+MeshCentral Proxy API over one persistent MeshCentral WebSocket
+
+Device routes (by device_id, or by selector, see device_selector.py):
 - /getDevices - Returns list of available devices
 - /getScreen - Returns screenshot of chosen device
-- /sendCommand - Sends command to chosen device
+- /sendCommand - Sends command to chosen device(s)
+- /runScript, /scripts - Runs registered scripts and returns parsed JSON
+- /saveJson - Writes a JSON file on chosen device(s)
+- /telemetry, /telemetry/fleet - Sampled CPU, memory and disk history
+
+Operations:
+- /health, /stats - Connection state, caches, send lanes, link and index stats
+- /admin/drain, /admin/traces, /admin/profile - Rolling deploys and diagnostics
 """
 
-from fastapi import FastAPI, HTTPException, Header
-from fastapi.responses import Response
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.responses import Response, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar, copy_context
+from collections import OrderedDict, deque, Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 import websocket
 import json
 import base64
@@ -21,7 +34,40 @@ import time
 import uuid
 import re
 import shlex
-from typing import Optional, Dict, List, Any
+import gzip
+import math
+import sys
+import itertools
+import signal
+import socket
+from array import array
+from typing import Optional, Dict, List, Any, Tuple
+
+from device_selector import DeviceIndex, os_family
+
+# Optional speedups for JSON responses; plain json and gzip are the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Optional compressed transport to MeshCentral (UPSTREAM_COMPRESSION)
+try:
+    from websockets.sync.client import connect as ws_connect
+    from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
+    from websockets.frames import DATA_OPCODES
+except ImportError:
+    ws_connect = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -31,15 +77,1536 @@ MESHCENTRAL_URL = os.getenv('DAISYCHAIN_URL', 'tee.up.railway.app')
 MESHCENTRAL_USERNAME = os.getenv('MESHCENTRAL_USERNAME')
 MESHCENTRAL_PASSWORD = os.getenv('MESHCENTRAL_PASSWORD')
 PROXY_API_KEY = os.getenv('PROXY_API_KEY')
+# Admin endpoints (traces, profiler, ...) use their own key if one is set
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY') or PROXY_API_KEY
+
+# Device request timeouts (seconds). Timeouts adapt per device between the
+# min and max once round-trip samples exist.
+COMMAND_TIMEOUT = float(os.getenv('COMMAND_TIMEOUT', 150))
+MIN_COMMAND_TIMEOUT = float(os.getenv('MIN_COMMAND_TIMEOUT', 15))
+LATENCY_EWMA_ALPHA = float(os.getenv('LATENCY_EWMA_ALPHA', 0.2))
+STUCK_DEVICE_TIMEOUTS = int(os.getenv('STUCK_DEVICE_TIMEOUTS', 3))
+
+# Result cache for idempotent commands. Commands matching one of the
+# ';'-separated patterns are cached unless the request opts out.
+COMMAND_CACHE_TTL = float(os.getenv('COMMAND_CACHE_TTL', 60))
+COMMAND_CACHE_SIZE = int(os.getenv('COMMAND_CACHE_SIZE', 1024))
+IDEMPOTENT_COMMAND_PATTERNS = [
+    re.compile(pattern) for pattern in os.getenv(
+        'IDEMPOTENT_COMMAND_PATTERNS',
+        r'^hostname$;^uname( -[a-z]+)?$;^df -h$;^ipconfig( /all)?$;^whoami$'
+    ).split(';') if pattern
+]
+
+# Outbound priority lanes: 'lane:weight' pairs, highest priority first. A lane
+# gets up to `weight` sends per scheduling round while it has work queued.
+SEND_LANE_WEIGHTS = OrderedDict(
+    (lane, int(weight)) for lane, weight in (
+        item.split(':') for item in os.getenv('SEND_LANE_WEIGHTS', 'interactive:8,normal:3,bulk:1').split(',')
+    )
+)
+if any(weight < 1 for weight in SEND_LANE_WEIGHTS.values()):
+    # A lane without credit would never be drained
+    raise ValueError(f"SEND_LANE_WEIGHTS must be at least 1 per lane: {dict(SEND_LANE_WEIGHTS)}")
+SEND_QUEUE_TIMEOUT = float(os.getenv('SEND_QUEUE_TIMEOUT', 30))
+
+# Background fleet telemetry (off by default). Metrics are sampled from online
+# devices every interval in staggered multi-node runcommands batches.
+TELEMETRY_ENABLED = os.getenv('TELEMETRY_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+TELEMETRY_INTERVAL = float(os.getenv('TELEMETRY_INTERVAL', 60))
+TELEMETRY_BATCH_SIZE = int(os.getenv('TELEMETRY_BATCH_SIZE', 50))
+TELEMETRY_METRICS = [m for m in os.getenv('TELEMETRY_METRICS', 'cpu,memory,disk').split(',') if m]
+# Retention as 'resolution_seconds:points'; 0 is the raw sample ring
+TELEMETRY_RETENTION = [
+    tuple(int(part) for part in level.split(':'))
+    for level in os.getenv('TELEMETRY_RETENTION', '0:360,300:288,3600:168').split(',')
+]
+
+# Request tracing: recent traces stay in memory, and are also appended as
+# JSONL to TRACE_EXPORT_PATH when it is set
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 500))
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH')
+MAX_PROFILE_SECONDS = float(os.getenv('MAX_PROFILE_SECONDS', 60))
+
+# Graceful shutdown: while draining, new work gets 503 and in-flight requests
+# get up to DRAIN_TIMEOUT seconds to finish. With HANDOVER_SOCKET set, a new
+# instance takes the warm device state from the old one over that unix socket,
+# and tells it to drain once it is connected to MeshCentral and serving HTTP.
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', COMMAND_TIMEOUT + 10))
+HANDOVER_SOCKET = os.getenv('HANDOVER_SOCKET')
+
+# Device selectors: requests addressed by selector fan out to at most this many
+# devices, sent as multi-node messages of SELECTOR_BATCH_SIZE nodes each
+MAX_SELECTOR_DEVICES = int(os.getenv('MAX_SELECTOR_DEVICES', 1000))
+SELECTOR_BATCH_SIZE = int(os.getenv('SELECTOR_BATCH_SIZE', 100))
+
+# Opt-in traffic recording for offline replay (see replay.py). Values of the
+# listed keys are replaced by their length before anything is written.
+TRAFFIC_RECORD_PATH = os.getenv('TRAFFIC_RECORD_PATH')
+TRAFFIC_RECORD_REDACT_KEYS = set(os.getenv(
+    'TRAFFIC_RECORD_REDACT_KEYS',
+    'password,cookie,authcookie,token,salt,hash,cmds,command,result,value,data'
+).split(','))
+
+# Response compression: bodies at least this many bytes are compressed with
+# the best encoding the client accepts
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+ZSTD_LEVEL = int(os.getenv('ZSTD_LEVEL', 3))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 4))
+
+# Upstream compression: negotiate permessage-deflate with MeshCentral (its
+# WsCompression setting must be on). Window bits are 9-15 and apply to both
+# directions; smaller windows use less memory per connection and compress less.
+UPSTREAM_COMPRESSION = os.getenv('UPSTREAM_COMPRESSION', 'false').lower() in ('1', 'true', 'yes')
+UPSTREAM_DEFLATE_WINDOW_BITS = int(os.getenv('UPSTREAM_DEFLATE_WINDOW_BITS', 15))
+UPSTREAM_DEFLATE_LEVEL = int(os.getenv('UPSTREAM_DEFLATE_LEVEL', 6))
+UPSTREAM_DEFLATE_MEM_LEVEL = int(os.getenv('UPSTREAM_DEFLATE_MEM_LEVEL', 8))
 
 # Global WebSocket manager
 ws_manager = None
 
+# Serves warm state to the next instance when HANDOVER_SOCKET is set
+handover_server = None
+
+# Fleet telemetry collector, started when TELEMETRY_ENABLED is set
+telemetry_collector = None
+
+
+class DeviceLatencyTracker:
+    """Tracks per-device round-trip times and derives adaptive timeouts
+
+    Uses the same smoothing as TCP's retransmission timer: an EWMA of the
+    round-trip time plus an EWMA of its mean deviation.
+    """
+
+    def __init__(self, alpha: float, min_timeout: float, max_timeout: float, stuck_after: int):
+        self.alpha = alpha
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.stuck_after = stuck_after
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def _entry(self, node_id: str, kind: str) -> Dict[str, Any]:
+        key = (node_id, kind)
+        if key not in self._stats:
+            self._stats[key] = {
+                'rtt': None,
+                'dev': 0.0,
+                'samples': 0,
+                'timeouts': 0,
+                'consecutive_timeouts': 0,
+                'last_seen': None
+            }
+        return self._stats[key]
+
+    def _update(self, entry: Dict[str, Any], rtt: float):
+        if entry['rtt'] is None:
+            entry['rtt'] = rtt
+            entry['dev'] = rtt / 2
+        else:
+            error = rtt - entry['rtt']
+            entry['rtt'] += self.alpha * error
+            entry['dev'] += self.alpha * (abs(error) - entry['dev'])
+
+    def record(self, node_id: str, kind: str, rtt: float):
+        """Record a successful round trip"""
+        with self._lock:
+            entry = self._entry(node_id, kind)
+            self._update(entry, rtt)
+            entry['samples'] += 1
+            entry['consecutive_timeouts'] = 0
+            entry['last_seen'] = time.time()
+
+    def record_timeout(self, node_id: str, kind: str, waited: float):
+        """Record a request that got no answer
+
+        The time waited is fed in as a sample so the next timeout backs off
+        instead of repeatedly cutting off a slow device.
+        """
+        with self._lock:
+            entry = self._entry(node_id, kind)
+            self._update(entry, waited)
+            entry['timeouts'] += 1
+            entry['consecutive_timeouts'] += 1
+
+    def timeout_for(self, node_id: str, kind: str) -> float:
+        """Timeout to use for the next request of this kind"""
+        with self._lock:
+            entry = self._stats.get((node_id, kind))
+            if not entry or entry['rtt'] is None:
+                return self.max_timeout
+            estimate = entry['rtt'] + 4 * entry['dev']
+        return min(self.max_timeout, max(self.min_timeout, estimate))
+
+    def hedge_after(self, node_id: str, kind: str) -> Optional[float]:
+        """Delay after which a duplicate request is worth sending, if known"""
+        with self._lock:
+            entry = self._stats.get((node_id, kind))
+            if not entry or entry['samples'] < 3:
+                return None
+            estimate = entry['rtt'] + 2 * entry['dev']
+        return min(estimate, self.timeout_for(node_id, kind) / 2)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Return per-device latency stats"""
+        with self._lock:
+            items = [(key, dict(entry)) for key, entry in self._stats.items()]
+
+        result = []
+        for (node_id, kind), entry in items:
+            result.append({
+                'device_id': node_id,
+                'kind': kind,
+                'rtt_ms': round(entry['rtt'] * 1000, 1) if entry['rtt'] is not None else None,
+                'deviation_ms': round(entry['dev'] * 1000, 1),
+                'samples': entry['samples'],
+                'timeouts': entry['timeouts'],
+                'consecutive_timeouts': entry['consecutive_timeouts'],
+                'stuck': entry['consecutive_timeouts'] >= self.stuck_after,
+                'timeout_s': round(self.timeout_for(node_id, kind), 1),
+                'last_seen': entry['last_seen']
+            })
+        return result
+
+    def export_state(self) -> List[List[Any]]:
+        """Raw per-device state, for handing over to another instance"""
+        with self._lock:
+            return [[node_id, kind, dict(entry)] for (node_id, kind), entry in self._stats.items()]
+
+    def load_state(self, state: List[List[Any]]):
+        """Restore state produced by export_state"""
+        with self._lock:
+            for node_id, kind, entry in state:
+                self._stats[(node_id, kind)] = entry
+
+
+class Trace:
+    """Timing spans for one HTTP request
+
+    Every MeshCentral responseid sent on behalf of the request starts with
+    the trace's internal key, then the trace id, so replies and server-side
+    logs can be tied back to it. The key is generated here because clients
+    may reuse an X-Trace-Id across concurrent requests.
+    """
+
+    def __init__(self, trace_id: str, method: str, path: str):
+        self.key = uuid.uuid4().hex[:16]
+        self.id = trace_id
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.status = None
+        self.duration_ms = None
+        self._t0 = time.monotonic()
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self.spans: List[Dict[str, Any]] = []
+
+    def next_message_id(self) -> str:
+        return f"{self.key}:{self.id}:{next(self._seq)}"
+
+    def add_span(self, name: str, start: float, duration: float, **attrs):
+        """Record a span; start is a time.monotonic() value"""
+        span = {
+            'name': name,
+            'start_ms': round((start - self._t0) * 1000, 3),
+            'duration_ms': round(duration * 1000, 3)
+        }
+        if attrs:
+            span['attrs'] = attrs
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self, status: Optional[int]):
+        self.status = status
+        self.duration_ms = round((time.monotonic() - self._t0) * 1000, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start_ms'])
+        return {
+            'trace_id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'started': self.started,
+            'status': self.status,
+            'duration_ms': self.duration_ms,
+            'spans': spans
+        }
+
+
+class TraceExporter:
+    """Keeps recent traces in memory and optionally appends them to a file"""
+
+    def __init__(self, buffer_size: int, path: Optional[str]):
+        self._lock = threading.Lock()
+        self._recent: deque = deque(maxlen=buffer_size)
+        self._file = open(path, 'a', encoding='utf-8', buffering=1) if path else None
+        self.active: Dict[str, Trace] = {}  # In-flight traces by Trace.key
+
+    def export(self, trace: Trace):
+        record = trace.to_dict()
+        with self._lock:
+            self._recent.append(record)
+            if self._file:
+                self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def recent(self, limit: int, min_ms: float = 0.0, path: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = list(self._recent)
+        traces = [
+            trace for trace in reversed(traces)
+            if (trace['duration_ms'] or 0) >= min_ms and (path is None or trace['path'] == path)
+        ]
+        return traces[:limit]
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+trace_exporter = TraceExporter(TRACE_BUFFER_SIZE, TRACE_EXPORT_PATH)
+
+
+@contextmanager
+def trace_span(name: str, **attrs):
+    """Time a block as a span of the current request's trace, if any"""
+    trace = current_trace.get()
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.add_span(name, start, time.monotonic() - start, **attrs)
+
+
+def new_message_id() -> str:
+    """responseid for an outbound message, prefixed with the trace key when traced"""
+    trace = current_trace.get()
+    return trace.next_message_id() if trace is not None else str(uuid.uuid4())
+
+
+def sample_stacks(seconds: float, interval: float) -> Counter:
+    """Sample every thread's Python stack, folded into 'frame;frame;...' counts"""
+    own_id = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            frames.append(names.get(thread_id, f"thread-{thread_id}"))
+            stacks[';'.join(reversed(frames))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+class OutboundScheduler:
+    """Weighted round-robin scheduler in front of the WebSocket send path
+
+    Messages are queued per priority lane and sent by one thread. In each
+    round a lane may send up to its weight in messages, and lanes are visited
+    in priority order, so interactive traffic overtakes queued bulk work
+    without starving it. Queue wait time is tracked per lane.
+    """
+
+    def __init__(self, send_fn, weights: Dict[str, int]):
+        self._send_fn = send_fn
+        self.weights = dict(weights)
+        self._cond = threading.Condition()
+        self._lanes: Dict[str, deque] = {lane: deque() for lane in weights}
+        self._credits = dict(weights)
+        self._stats = {
+            lane: {'sent': 0, 'failed': 0, 'cancelled': 0, 'wait_ewma_ms': 0.0, 'wait_max_ms': 0.0}
+            for lane in weights
+        }
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, data: Dict, lane: str) -> Dict[str, Any]:
+        """Queue a message; the returned item's 'done' event is set once it was sent"""
+        if lane not in self._lanes:
+            lane = 'normal' if 'normal' in self._lanes else next(iter(self._lanes))
+        item = {
+            'data': data,
+            'lane': lane,
+            'queued_at': time.monotonic(),
+            'done': threading.Event(),
+            'ok': False,
+            'trace': current_trace.get()
+        }
+        with self._cond:
+            self._lanes[lane].append(item)
+            self._cond.notify()
+        return item
+
+    def cancel(self, item: Dict[str, Any]) -> bool:
+        """Take a message off its lane; False if the sender already picked it up"""
+        with self._cond:
+            try:
+                self._lanes[item['lane']].remove(item)
+            except ValueError:
+                return False
+            self._stats[item['lane']]['cancelled'] += 1
+            return True
+
+    def _next(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Pick the next message; caller holds the condition"""
+        for _ in range(2):
+            for lane, items in self._lanes.items():
+                if items and self._credits[lane] > 0:
+                    self._credits[lane] -= 1
+                    return lane, items.popleft()
+            # Every lane with work is out of credit: start a new round
+            self._credits = dict(self.weights)
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                picked = self._next()
+                while picked is None and self._running:
+                    self._cond.wait()
+                    picked = self._next()
+                if picked is None:
+                    return
+
+            lane, item = picked
+            dequeued_at = time.monotonic()
+            wait_ms = (dequeued_at - item['queued_at']) * 1000
+            item['ok'] = self._send_fn(item['data'])
+            sent_at = time.monotonic()
+            item['done'].set()
+
+            trace = item['trace']
+            if trace is not None:
+                trace.add_span('send.queue_wait', item['queued_at'], dequeued_at - item['queued_at'], lane=lane)
+                trace.add_span('send.write', dequeued_at, sent_at - dequeued_at)
+
+            with self._cond:
+                stats = self._stats[lane]
+                stats['sent' if item['ok'] else 'failed'] += 1
+                stats['wait_ewma_ms'] += 0.1 * (wait_ms - stats['wait_ewma_ms'])
+                stats['wait_max_ms'] = max(stats['wait_max_ms'], wait_ms)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-lane queue depth, send counts and queue wait times"""
+        with self._cond:
+            return {
+                lane: {
+                    'weight': self.weights[lane],
+                    'queued': len(self._lanes[lane]),
+                    'sent': stats['sent'],
+                    'failed': stats['failed'],
+                    'cancelled': stats['cancelled'],
+                    'wait_ewma_ms': round(stats['wait_ewma_ms'], 2),
+                    'wait_max_ms': round(stats['wait_max_ms'], 2)
+                }
+                for lane, stats in self._stats.items()
+            }
+
+
+class TrafficRecorder:
+    """Append-only JSONL log of WebSocket frames and API requests with timing
+
+    Each line is [seconds_since_start, "in" | "out" | "http", payload]. An
+    "http" line is an API request ({key, method, path, query, body}); an
+    outbound frame sent on behalf of one carries a fourth element
+    {key, route} naming it. Redacted values become "<redacted:N>", keeping
+    their length so a replay moves the same number of bytes.
+    """
+
+    def __init__(self, path: str, redact_keys: set):
+        self.path = path
+        self.redact_keys = redact_keys
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+        self._write(0.0, 'meta', {'started': time.time(), 'redacted': sorted(redact_keys)})
+
+    def _redact(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            return {
+                key: (f"<redacted:{len(str(item))}>" if key in self.redact_keys and item is not None
+                      and not isinstance(item, (dict, list)) else self._redact(item))
+                for key, item in value.items()
+            }
+        if isinstance(value, list):
+            return [self._redact(item) for item in value]
+        return value
+
+    def _write(self, offset: float, direction: str, payload: Any, origin: Optional[Dict] = None):
+        entry = [round(offset, 4), direction, payload]
+        if origin:
+            entry.append(origin)
+        line = json.dumps(entry, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def record(self, direction: str, payload: Dict, origin: Optional[Dict] = None,
+               at: Optional[float] = None):
+        """Record one inbound ('in') or outbound ('out') frame, seen at time.monotonic() at"""
+        try:
+            offset = (at if at is not None else time.monotonic()) - self._started
+            self._write(offset, direction, self._redact(payload), origin)
+        except Exception as e:
+            logger.error(f"Traffic recording error: {e}")
+
+    def record_request(self, key: str, method: str, path: str, query: str, body: Any):
+        """Record an API request; frames sent for it name the same key"""
+        self.record('http', {'key': key, 'method': method, 'path': path, 'query': query, 'body': body})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class CommandResultCache:
+    """LRU cache with per-entry TTL that also coalesces concurrent misses
+
+    While a result for a key is being fetched, other callers for the same key
+    wait on the in-flight request instead of sending their own.
+    """
+
+    def __init__(self, max_entries: int, default_ttl: float):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._inflight: Dict[Any, Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get_or_run(self, key, fetch, ttl: Optional[float] = None) -> Tuple[Any, str]:
+        """Return (value, 'hit' | 'miss' | 'coalesced'), calling fetch on a miss
+
+        None results are never cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, 'hit'
+                del self._entries[key]
+
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if owner:
+            try:
+                value = fetch()
+            except Exception as e:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                future.set_exception(e)
+                raise
+
+            with self._lock:
+                self._inflight.pop(key, None)
+                if value is not None:
+                    ttl = self.default_ttl if ttl is None else ttl
+                    self._entries[key] = (time.monotonic() + ttl, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            future.set_result(value)
+            return value, 'miss'
+
+        return future.result(), 'coalesced'
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'in_flight': len(self._inflight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0
+            }
+
+    def export_state(self) -> List[List[Any]]:
+        """Unexpired entries as [key, seconds left, value], oldest first"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                [list(key), expires - now, value]
+                for key, (expires, value) in self._entries.items()
+                if expires > now
+            ]
+
+    def load_state(self, state: List[List[Any]]):
+        """Restore entries produced by export_state"""
+        now = time.monotonic()
+        with self._lock:
+            for key, remaining, value in state:
+                self._entries[tuple(key)] = (now + remaining, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def is_idempotent_command(command: str) -> bool:
+    """Check a command against the idempotent allowlist"""
+    command = command.strip()
+    return any(pattern.search(command) for pattern in IDEMPOTENT_COMMAND_PATTERNS)
+
+def _quote_powershell(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _json_list(output: str) -> List[Dict]:
+    """ConvertTo-Json returns an object for one item and an array for several"""
+    data = json.loads(output)
+    return data if isinstance(data, list) else [data]
+
+
+def _parse_hostname(output: str) -> Dict:
+    return {'hostname': output.strip()}
+
+
+def _parse_uptime(output: str) -> Dict:
+    return {'uptime_seconds': float(output.split()[0])}
+
+
+DF_CAPACITY = re.compile(r'^\d+%$')
+
+
+def _parse_df(output: str) -> Dict:
+    """df -kP rows, anchored on the capacity column
+
+    Filesystem and mount names may contain spaces (macOS prints
+    'map auto_home'), so the three sizes are the fields just left of the
+    first NN% field. Rows without one, or with non-numeric sizes, are skipped.
+    """
+    disks = []
+    for line in output.strip().splitlines()[1:]:
+        fields = line.split()
+        capacity = next((i for i, field in enumerate(fields) if i >= 4 and DF_CAPACITY.match(field)), None)
+        if capacity is None:
+            continue
+        try:
+            size, used, free = (int(field) * 1024 for field in fields[capacity - 3:capacity])
+        except ValueError:
+            continue
+        disks.append({
+            'filesystem': ' '.join(fields[:capacity - 3]),
+            'size_bytes': size,
+            'used_bytes': used,
+            'free_bytes': free,
+            'mount': ' '.join(fields[capacity + 1:])
+        })
+    return {'disks': disks}
+
+
+def _parse_windows_disks(output: str) -> Dict:
+    disks = []
+    for disk in _json_list(output):
+        size = int(disk.get('Size') or 0)
+        free = int(disk.get('FreeSpace') or 0)
+        disks.append({
+            'filesystem': disk.get('DeviceID'),
+            'size_bytes': size,
+            'used_bytes': size - free,
+            'free_bytes': free,
+            'mount': disk.get('DeviceID')
+        })
+    return {'disks': disks}
+
+
+def _parse_meminfo(output: str) -> Dict:
+    values = {}
+    for line in output.splitlines():
+        key, _, rest = line.partition(':')
+        if rest.strip():
+            values[key.strip()] = int(rest.split()[0]) * 1024
+    total = values['MemTotal']
+    available = values.get('MemAvailable', values.get('MemFree', 0))
+    return {'total_bytes': total, 'available_bytes': available, 'used_bytes': total - available}
+
+
+def _parse_vm_stat(output: str) -> Dict:
+    lines = output.strip().splitlines()
+    total, page_size = int(lines[0]), int(lines[1])
+    pages = {}
+    for line in lines[2:]:
+        key, _, rest = line.partition(':')
+        if rest.strip().rstrip('.').isdigit():
+            pages[key.strip()] = int(rest.strip().rstrip('.'))
+    available = (pages.get('Pages free', 0) + pages.get('Pages inactive', 0)
+                 + pages.get('Pages speculative', 0)) * page_size
+    return {'total_bytes': total, 'available_bytes': available, 'used_bytes': total - available}
+
+
+def _parse_windows_memory(output: str) -> Dict:
+    data = _json_list(output)[0]
+    total = int(data['TotalVisibleMemorySize']) * 1024
+    available = int(data['FreePhysicalMemory']) * 1024
+    return {'total_bytes': total, 'available_bytes': available, 'used_bytes': total - available}
+
+
+def _parse_ps(output: str) -> Dict:
+    processes = []
+    for line in output.strip().splitlines()[1:]:
+        fields = line.split(None, 3)
+        if len(fields) == 4:
+            processes.append({
+                'pid': int(fields[0]),
+                'cpu_percent': float(fields[1]),
+                'memory_percent': float(fields[2]),
+                'name': fields[3]
+            })
+    return {'processes': processes}
+
+
+def _parse_windows_processes(output: str) -> Dict:
+    return {'processes': [
+        {
+            'pid': proc.get('Id'),
+            'cpu_seconds': proc.get('CPU'),
+            'memory_bytes': proc.get('WorkingSet64'),
+            'name': proc.get('ProcessName')
+        }
+        for proc in _json_list(output)
+    ]}
+
+
+def _parse_os_release(output: str) -> Dict:
+    lines = output.strip().splitlines()
+    values = {}
+    for line in lines[:-1]:
+        key, sep, value = line.partition('=')
+        if sep:
+            values[key.strip()] = value.strip().strip('"')
+    kernel = lines[-1].split() if lines else []
+    return {
+        'name': values.get('PRETTY_NAME') or values.get('NAME'),
+        'version': values.get('VERSION_ID'),
+        'kernel': kernel[1] if len(kernel) > 1 else None,
+        'architecture': kernel[-1] if kernel else None
+    }
+
+
+def _parse_sw_vers(output: str) -> Dict:
+    lines = output.strip().splitlines()
+    values = {}
+    for line in lines[:-1]:
+        key, sep, value = line.partition(':')
+        if sep:
+            values[key.strip()] = value.strip()
+    kernel = lines[-1].split() if lines else []
+    return {
+        'name': values.get('ProductName'),
+        'version': values.get('ProductVersion'),
+        'kernel': kernel[1] if len(kernel) > 1 else None,
+        'architecture': kernel[-1] if kernel else None
+    }
+
+
+def _parse_windows_os(output: str) -> Dict:
+    data = _json_list(output)[0]
+    return {
+        'name': data.get('Caption'),
+        'version': data.get('Version'),
+        'kernel': data.get('Version'),
+        'architecture': data.get('OSArchitecture')
+    }
+
+
+class ScriptOutputError(Exception):
+    """A script ran but its output could not be parsed"""
+
+    def __init__(self, message: str, output: str):
+        super().__init__(message)
+        self.output = output
+
+
+class ScriptDefinition:
+    """A named script with typed parameters, per-OS variants and an output parser
+
+    Variants map an OS family to (runcommands type, template, parser).
+    Templates reference parameters as {{name}}; values are validated and
+    quoted for the variant's shell before substitution.
+    """
+
+    def __init__(self, name: str, description: str, variants: Dict[str, Tuple[int, str, Any]],
+                 params: Optional[Dict[str, Dict[str, Any]]] = None, cache_ttl: Optional[float] = None):
+        self.name = name
+        self.description = description
+        self.variants = variants
+        self.params = params or {}
+        self.cache_ttl = cache_ttl
+
+    def validate(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Check parameter values against their declared types, applying defaults"""
+        unknown = set(values) - set(self.params)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+
+        result = {}
+        for name, spec in self.params.items():
+            value = values.get(name, spec.get('default'))
+            if value is None:
+                raise ValueError(f"Missing parameter: {name}")
+            if spec['type'] == 'int':
+                if isinstance(value, bool) or not isinstance(value, int):
+                    raise ValueError(f"Parameter {name} must be an integer")
+                if not spec.get('min', value) <= value <= spec.get('max', value):
+                    raise ValueError(f"Parameter {name} must be between {spec.get('min')} and {spec.get('max')}")
+            elif spec['type'] == 'str':
+                if not isinstance(value, str) or not re.match(spec.get('pattern', r'^.*$'), value):
+                    raise ValueError(f"Parameter {name} is not valid")
+            result[name] = value
+        return result
+
+    def render(self, family: str, values: Dict[str, Any]) -> Tuple[int, str, Any]:
+        """Return (runcommands type, command, parser) for an OS family"""
+        if family not in self.variants:
+            raise ValueError(f"Script {self.name} has no {family} variant")
+        command_type, template, parser = self.variants[family]
+        quote = _quote_powershell if command_type == 2 else shlex.quote
+        params = self.validate(values)
+
+        def substitute(match):
+            value = params[match.group(1)]
+            return str(value) if isinstance(value, int) else quote(value)
+
+        return command_type, re.sub(r'\{\{(\w+)\}\}', substitute, template), parser
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'description': self.description,
+            'params': self.params,
+            'os': sorted(self.variants)
+        }
+
+
+SCRIPT_REGISTRY: Dict[str, ScriptDefinition] = {script.name: script for script in [
+    ScriptDefinition('hostname', "Device hostname", {
+        'linux': (0, "hostname", _parse_hostname),
+        'macos': (0, "hostname", _parse_hostname),
+        'windows': (2, "[System.Net.Dns]::GetHostName()", _parse_hostname),
+    }, cache_ttl=300),
+    ScriptDefinition('uptime', "Seconds since boot", {
+        'linux': (0, "cat /proc/uptime", _parse_uptime),
+        'macos': (0, "echo $(( $(date +%s) - $(sysctl -n kern.boottime | sed 's/.*{ sec = \\([0-9]*\\),.*/\\1/') ))",
+                  _parse_uptime),
+        'windows': (2, "[int]((Get-Date) - (Get-CimInstance Win32_OperatingSystem).LastBootUpTime).TotalSeconds",
+                    _parse_uptime),
+    }, cache_ttl=30),
+    ScriptDefinition('disk_usage', "Size, used and free bytes per filesystem", {
+        'linux': (0, "df -kP", _parse_df),
+        'macos': (0, "df -kP", _parse_df),
+        'windows': (2, "Get-CimInstance Win32_LogicalDisk -Filter 'DriveType=3' | "
+                       "Select-Object DeviceID,Size,FreeSpace | ConvertTo-Json -Compress", _parse_windows_disks),
+    }, cache_ttl=60),
+    ScriptDefinition('memory', "Total, used and available memory in bytes", {
+        'linux': (0, "cat /proc/meminfo", _parse_meminfo),
+        'macos': (0, "sysctl -n hw.memsize hw.pagesize; vm_stat", _parse_vm_stat),
+        'windows': (2, "Get-CimInstance Win32_OperatingSystem | "
+                       "Select-Object TotalVisibleMemorySize,FreePhysicalMemory | ConvertTo-Json -Compress",
+                    _parse_windows_memory),
+    }, cache_ttl=15),
+    ScriptDefinition('top_processes', "Processes using the most CPU", {
+        'linux': (0, "ps -eo pid,pcpu,pmem,comm --sort=-pcpu | head -n $(( {{count}} + 1 ))", _parse_ps),
+        'macos': (0, "ps -Ao pid,pcpu,pmem,comm -r | head -n $(( {{count}} + 1 ))", _parse_ps),
+        'windows': (2, "Get-Process | Sort-Object CPU -Descending | Select-Object -First {{count}} "
+                       "Id,CPU,WorkingSet64,ProcessName | ConvertTo-Json -Compress", _parse_windows_processes),
+    }, params={'count': {'type': 'int', 'default': 10, 'min': 1, 'max': 100}}, cache_ttl=10),
+    ScriptDefinition('os_info', "Operating system name, version, kernel and architecture", {
+        'linux': (0, "cat /etc/os-release; uname -srm", _parse_os_release),
+        'macos': (0, "sw_vers; uname -srm", _parse_sw_vers),
+        'windows': (2, "Get-CimInstance Win32_OperatingSystem | "
+                       "Select-Object Caption,Version,OSArchitecture | ConvertTo-Json -Compress", _parse_windows_os),
+    }, cache_ttl=3600),
+]}
+
+
+# Shell snippets printing 'metric=value' (percent) per OS family
+TELEMETRY_COMMANDS: Dict[str, Dict[str, str]] = {
+    'cpu': {
+        # Utilisation over a one-second window, not load average (which can pass 100)
+        'linux': """{ head -1 /proc/stat; sleep 1; head -1 /proc/stat; } | awk '{idle = $5 + $6; total = 0; for (i = 2; i <= NF; i++) total += $i} NR == 1 {i0 = idle; t0 = total} NR == 2 {printf "cpu=%.1f\\n", (1 - (idle - i0) / (total - t0)) * 100}'""",
+        'macos': """top -l 2 -s 1 -n 0 | awk '/CPU usage/{idle = $7} END {sub("%", "", idle); printf "cpu=%.1f\\n", 100 - idle}'""",
+        'windows': """"cpu=" + (Get-CimInstance Win32_Processor | Measure-Object -Property LoadPercentage -Average).Average""",
+    },
+    'memory': {
+        'linux': """awk '/MemTotal/{t=$2} /MemAvailable/{a=$2} END{printf "memory=%.1f\\n", (t-a)/t*100}' /proc/meminfo""",
+        'macos': """vm_stat | awk -v t=$(sysctl -n hw.memsize) '/page size of/{p=$8} /Pages free/{f=$3} /Pages inactive/{i=$3} END{printf "memory=%.1f\\n", (t-(f+i)*p)/t*100}'""",
+        'windows': """$o = Get-CimInstance Win32_OperatingSystem; "memory=" + [math]::Round(($o.TotalVisibleMemorySize - $o.FreePhysicalMemory) / $o.TotalVisibleMemorySize * 100, 1)""",
+    },
+    'disk': {
+        'linux': """df -P / | awk 'NR==2{sub("%","",$5); print "disk=" $5}'""",
+        'macos': """df -P / | awk 'NR==2{sub("%","",$5); print "disk=" $5}'""",
+        'windows': """$d = Get-CimInstance Win32_LogicalDisk -Filter "DeviceID='C:'"; "disk=" + [math]::Round(($d.Size - $d.FreeSpace) / $d.Size * 100, 1)""",
+    },
+}
+
+
+class RingSeries:
+    """Fixed-capacity ring of (timestamp, value) samples in two array('d')s"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.start = 0
+        self.count = 0
+
+    def append(self, timestamp: float, value: float):
+        index = (self.start + self.count) % self.capacity
+        self.times[index] = timestamp
+        self.values[index] = value
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def oldest(self) -> Optional[float]:
+        return self.times[self.start] if self.count else None
+
+    def last(self) -> Optional[Tuple[float, float]]:
+        if not self.count:
+            return None
+        index = (self.start + self.count - 1) % self.capacity
+        return self.times[index], self.values[index]
+
+    def range(self, start: float, end: float) -> List[Tuple[float, float]]:
+        points = []
+        for offset in range(self.count):
+            index = (self.start + offset) % self.capacity
+            if start <= self.times[index] <= end:
+                points.append((self.times[index], self.values[index]))
+        return points
+
+
+class DownsampledSeries:
+    """Raw samples plus coarser rings holding per-interval averages"""
+
+    def __init__(self, retention: List[Tuple[int, int]]):
+        self.levels = [(resolution, RingSeries(points)) for resolution, points in sorted(retention)]
+        # Running (bucket, sum, count) for each downsampled level
+        self._pending = [None] * len(self.levels)
+
+    def append(self, timestamp: float, value: float):
+        for i, (resolution, ring) in enumerate(self.levels):
+            if resolution == 0:
+                ring.append(timestamp, value)
+                continue
+            bucket = math.floor(timestamp / resolution)
+            pending = self._pending[i]
+            if pending and pending[0] != bucket:
+                ring.append(pending[0] * resolution, pending[1] / pending[2])
+                pending = None
+            if pending is None:
+                self._pending[i] = [bucket, value, 1]
+            else:
+                pending[1] += value
+                pending[2] += 1
+
+    def query(self, start: float, end: float, resolution: Optional[int] = None) -> Tuple[int, List[Tuple[float, float]]]:
+        """Points from the finest level that still covers start, or the requested resolution"""
+        candidates = self.levels
+        if resolution is not None:
+            candidates = [level for level in self.levels if level[0] >= resolution] or self.levels[-1:]
+        for level_resolution, ring in candidates:
+            oldest = ring.oldest()
+            if oldest is not None and oldest <= start:
+                return level_resolution, ring.range(start, end)
+        # Nothing reaches back far enough: use the level with the longest history
+        level_resolution, ring = min(
+            candidates, key=lambda level: level[1].oldest() if level[1].count else float('inf')
+        )
+        return level_resolution, ring.range(start, end)
+
+    def last(self) -> Optional[Tuple[float, float]]:
+        return self.levels[0][1].last()
+
+
+class TimeSeriesStore:
+    """In-memory per-device, per-metric time series"""
+
+    def __init__(self, retention: List[Tuple[int, int]]):
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], DownsampledSeries] = {}
+
+    def add(self, node_id: str, metric: str, timestamp: float, value: float):
+        with self._lock:
+            series = self._series.get((node_id, metric))
+            if series is None:
+                series = self._series[(node_id, metric)] = DownsampledSeries(self.retention)
+            series.append(timestamp, value)
+
+    def query(self, node_id: str, metric: str, start: float, end: float,
+              resolution: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            series = self._series.get((node_id, metric))
+            if series is None:
+                return None
+            level, points = series.query(start, end, resolution)
+        return {'resolution': level, 'points': points}
+
+    def latest(self, metric: Optional[str] = None) -> Dict[str, Dict[str, Tuple[float, float]]]:
+        """Most recent sample of each metric per device"""
+        result: Dict[str, Dict[str, Tuple[float, float]]] = {}
+        with self._lock:
+            for (node_id, series_metric), series in self._series.items():
+                if metric and series_metric != metric:
+                    continue
+                last = series.last()
+                if last is not None:
+                    result.setdefault(node_id, {})[series_metric] = last
+        return result
+
+    def __len__(self):
+        with self._lock:
+            return len(self._series)
+
+
+def runcommands_message(node_ids: List[str], command: str, command_type: int = 0) -> Dict[str, Any]:
+    """MeshCentral runcommands for one or many nodes
+
+    'reply' makes MeshCentral return each agent's output, tagged with its
+    nodeid, instead of a bare acknowledgement that the command was sent.
+    """
+    return {
+        'action': 'runcommands',
+        'nodeids': node_ids,
+        'type': command_type,  # 0=shell, 1=cmd, 2=powershell
+        'cmds': command,
+        'runAsUser': 0,  # 0=run as root/agent, 1=run as logged-in user
+        'reply': True
+    }
+
+
+class TelemetryCollector:
+    """Periodically samples metrics from online devices into a TimeSeriesStore
+
+    Each cycle groups online devices by OS family and sends one multi-node
+    runcommands per batch on the bulk lane. Batches are spread evenly across
+    the interval so the load on MeshCentral stays flat. A cycle is skipped
+    while batches of the previous one are still running, so slow devices
+    cannot build up a backlog.
+    """
+
+    def __init__(self, manager, store: TimeSeriesStore, metrics: List[str],
+                 interval: float, batch_size: int):
+        self.manager = manager
+        self.store = store
+        self.metrics = [metric for metric in metrics if metric in TELEMETRY_COMMANDS]
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='telemetry')
+        self.cycles = 0
+        self.samples = 0
+        self.failed_batches = 0
+        self.skipped_cycles = 0
+        self.last_cycle_devices = 0
+        self._in_flight: List[Future] = []
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info(f"Telemetry collector started: {', '.join(self.metrics)} every {self.interval}s")
+
+    def stop(self):
+        self._stop.set()
+        self._pool.shutdown(wait=False)
+
+    def command_for(self, family: str) -> Tuple[int, str]:
+        """(runcommands type, script) sampling all metrics for an OS family"""
+        parts = [TELEMETRY_COMMANDS[metric][family] for metric in self.metrics]
+        if family == 'windows':
+            return 2, '; '.join(parts)
+        return 0, '\n'.join(parts)
+
+    def _batches(self) -> List[Tuple[str, List[str]]]:
+        by_family: Dict[str, List[str]] = {}
+        for device in self.manager.get_devices_list():
+            if device['online']:
+                by_family.setdefault(os_family(device['os']), []).append(device['id'])
+        self.last_cycle_devices = sum(len(ids) for ids in by_family.values())
+        return [
+            (family, ids[i:i + self.batch_size])
+            for family, ids in sorted(by_family.items())
+            for i in range(0, len(ids), self.batch_size)
+        ]
+
+    def _run(self):
+        while not self._stop.is_set():
+            cycle_start = time.monotonic()
+            if self.manager.authenticated and any(not future.done() for future in self._in_flight):
+                self.skipped_cycles += 1
+                logger.warning("Telemetry cycle skipped, the previous one is still running")
+            elif self.manager.authenticated:
+                batches = self._batches()
+                spacing = self.interval / max(1, len(batches))
+                self._in_flight = []
+                for i, (family, node_ids) in enumerate(batches):
+                    if self._stop.wait(max(0.0, cycle_start + i * spacing - time.monotonic())):
+                        return
+                    self._in_flight.append(self._pool.submit(self._collect, family, node_ids, spacing))
+                self.cycles += 1
+            self._stop.wait(max(0.0, cycle_start + self.interval - time.monotonic()))
+
+    def _collect(self, family: str, node_ids: List[str], timeout: float):
+        command_type, command = self.command_for(family)
+        msg = runcommands_message(node_ids, command, command_type)
+        try:
+            replies = self.manager.send_and_collect(msg, len(node_ids), timeout=max(timeout, 10), lane='bulk')
+        except Exception as e:
+            logger.error(f"Telemetry batch error: {e}")
+            replies = []
+        if not replies:
+            self.failed_batches += 1
+            return
+
+        now = time.time()
+        for reply in replies:
+            # Multi-node replies are attributed by nodeid; a lone node needs none
+            node_id = reply.get('nodeid') or (node_ids[0] if len(node_ids) == 1 else None)
+            if node_id is None:
+                continue
+            for line in str(reply.get('result', '')).splitlines():
+                metric, sep, value = line.strip().partition('=')
+                if sep and metric in self.metrics:
+                    try:
+                        self.store.add(node_id, metric, now, float(value))
+                        self.samples += 1
+                    except ValueError:
+                        continue
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'metrics': self.metrics,
+            'interval_s': self.interval,
+            'cycles': self.cycles,
+            'samples': self.samples,
+            'failed_batches': self.failed_batches,
+            'skipped_cycles': self.skipped_cycles,
+            'devices_last_cycle': self.last_cycle_devices,
+            'series': len(self.store)
+        }
+
+
+# Fleet telemetry, populated by the collector
+telemetry_store = TimeSeriesStore(TELEMETRY_RETENTION)
+
+
+def text_size(message) -> int:
+    """Size in bytes of a WebSocket payload, without encoding ASCII text"""
+    if isinstance(message, str) and not message.isascii():
+        return len(message.encode('utf-8'))
+    return len(message)
+
+
+class UpstreamLinkStats:
+    """Message and byte counters for the MeshCentral link
+
+    raw bytes are payloads as sent/received by the proxy, wire bytes are what
+    crossed the network after permessage-deflate (equal when uncompressed).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.compression: Optional[Dict[str, Any]] = None
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.sent_raw = 0
+        self.sent_wire = 0
+        self.received_raw = 0
+        self.received_wire = 0
+
+    def add_sent(self, raw: int, wire: int, messages: int = 0):
+        with self._lock:
+            self.messages_sent += messages
+            self.sent_raw += raw
+            self.sent_wire += wire
+
+    def add_received(self, raw: int, wire: int, messages: int = 0):
+        with self._lock:
+            self.messages_received += messages
+            self.received_raw += raw
+            self.received_wire += wire
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            def ratio(raw, wire):
+                return round(wire / raw, 3) if raw else None
+
+            return {
+                'compression': self.compression,
+                'messages_sent': self.messages_sent,
+                'messages_received': self.messages_received,
+                'sent_raw_bytes': self.sent_raw,
+                'sent_wire_bytes': self.sent_wire,
+                'sent_ratio': ratio(self.sent_raw, self.sent_wire),
+                'received_raw_bytes': self.received_raw,
+                'received_wire_bytes': self.received_wire,
+                'received_ratio': ratio(self.received_raw, self.received_wire)
+            }
+
+
+class CountingDeflateExtension:
+    """Wraps a negotiated permessage-deflate extension to count frame bytes"""
+
+    def __init__(self, inner, stats: UpstreamLinkStats):
+        self.inner = inner
+        self.name = inner.name
+        self.stats = stats
+
+    def encode(self, frame):
+        encoded = self.inner.encode(frame)
+        if frame.opcode in DATA_OPCODES:
+            self.stats.add_sent(len(frame.data), len(encoded.data))
+        return encoded
+
+    def decode(self, frame, *, max_size: Optional[int] = None):
+        decoded = self.inner.decode(frame, max_size=max_size)
+        if frame.opcode in DATA_OPCODES:
+            self.stats.add_received(len(decoded.data), len(frame.data))
+        return decoded
+
+
+class CountingDeflateFactory:
+    """Client permessage-deflate offer whose accepted extension counts bytes"""
+
+    def __init__(self, stats: UpstreamLinkStats, window_bits: int, level: int, mem_level: int):
+        self.inner = ClientPerMessageDeflateFactory(
+            server_max_window_bits=window_bits,
+            client_max_window_bits=window_bits,
+            compress_settings={'level': level, 'memLevel': mem_level}
+        )
+        self.name = self.inner.name
+        self.stats = stats
+
+    def get_request_params(self):
+        return self.inner.get_request_params()
+
+    def process_response_params(self, params, accepted_extensions):
+        extension = self.inner.process_response_params(params, accepted_extensions)
+        return CountingDeflateExtension(extension, self.stats)
+
+
+class DeflateWebSocketApp:
+    """The part of websocket.WebSocketApp the manager uses, on the websockets client
+
+    websocket-client can't negotiate permessage-deflate; the websockets
+    library can. Callbacks get the same arguments as with WebSocketApp.
+    """
+
+    def __init__(self, url: str, header: List[str], on_open, on_message, on_error, on_close,
+                 stats: UpstreamLinkStats):
+        self.url = url
+        self.headers = [tuple(line.split(': ', 1)) for line in header]
+        self.on_open = on_open
+        self.on_message = on_message
+        self.on_error = on_error
+        self.on_close = on_close
+        self.stats = stats
+        self.compressed = False
+        self._conn = None
+
+    def run_forever(self):
+        """Connect and dispatch messages until the connection closes"""
+        factory = CountingDeflateFactory(
+            self.stats, UPSTREAM_DEFLATE_WINDOW_BITS, UPSTREAM_DEFLATE_LEVEL, UPSTREAM_DEFLATE_MEM_LEVEL
+        )
+        try:
+            self._conn = ws_connect(
+                self.url,
+                additional_headers=self.headers,
+                extensions=[factory],
+                compression=None,
+                max_size=None,
+                open_timeout=30
+            )
+        except Exception as e:
+            self.on_error(self, e)
+            self.on_close(self, None, None)
+            return
+
+        extensions = self._conn.protocol.extensions
+        self.compressed = bool(extensions)
+        self.stats.compression = {
+            'window_bits': {
+                'client': extensions[0].inner.local_max_window_bits or 15,
+                'server': extensions[0].inner.remote_max_window_bits or 15
+            },
+            'level': UPSTREAM_DEFLATE_LEVEL
+        } if extensions else None
+        if not extensions:
+            logger.warning("MeshCentral declined permessage-deflate, upstream link is uncompressed")
+
+        try:
+            self.on_open(self)
+            for message in self._conn:
+                if self.compressed:
+                    self.stats.add_received(0, 0, messages=1)
+                else:
+                    size = text_size(message)
+                    self.stats.add_received(size, size, messages=1)
+                self.on_message(self, message)
+        except Exception as e:
+            self.on_error(self, e)
+        finally:
+            self._conn.close()
+            self.on_close(self, self._conn.protocol.close_code, self._conn.protocol.close_reason)
+
+    def send(self, message: str):
+        self._conn.send(message)
+        if self.compressed:
+            self.stats.add_sent(0, 0, messages=1)
+        else:
+            size = text_size(message)
+            self.stats.add_sent(size, size, messages=1)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+
+
+class DrainController:
+    """Counts in-flight HTTP requests and tracks the drain state"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.started: Optional[float] = None
+        self.deadline: Optional[float] = None
+        self.reason: Optional[str] = None
+        self.finished = False
+
+    @property
+    def draining(self) -> bool:
+        return self.started is not None
+
+    def enter(self) -> bool:
+        """Count a new request; False once draining"""
+        with self._lock:
+            if self.started is not None:
+                return False
+            self.in_flight += 1
+            return True
+
+    def exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def start(self, timeout: float, reason: str) -> bool:
+        """Begin draining; False if a drain was already running"""
+        with self._lock:
+            if self.started is not None:
+                return False
+            self.started = time.monotonic()
+            self.deadline = self.started + timeout
+            self.reason = reason
+        logger.info(f"Draining ({reason}), {self.in_flight} requests in flight, deadline {timeout:.0f}s")
+        return True
+
+    def wait(self, pending_responses) -> bool:
+        """Block until requests and MeshCentral responses are done or the deadline passes
+
+        pending_responses is called to count outstanding response queues.
+        Returns True if everything finished in time.
+        """
+        while time.monotonic() < self.deadline:
+            if self.in_flight == 0 and pending_responses() == 0:
+                break
+            time.sleep(0.1)
+        self.finished = True
+        done = self.in_flight == 0 and pending_responses() == 0
+        if done:
+            logger.info(f"Drained in {time.monotonic() - self.started:.1f}s")
+        else:
+            logger.warning(f"Drain deadline passed with {self.in_flight} requests "
+                           f"and {pending_responses()} responses outstanding")
+        return done
+
+    def status(self, pending_responses: int) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'draining': self.draining,
+            'reason': self.reason,
+            'finished': self.finished,
+            'in_flight_requests': self.in_flight,
+            'pending_responses': pending_responses,
+            'elapsed_s': round(now - self.started, 1) if self.started else None,
+            'remaining_s': round(max(0.0, self.deadline - now), 1) if self.deadline else None
+        }
+
+
+def handover_request(path: str, op: str, timeout: float = 30.0) -> Optional[Dict[str, Any]]:
+    """Send one request ('state' or 'drain') to the instance on a handover socket
+
+    A 'drain' reply is confirmed back, and only then does the other instance
+    let go of the socket; this returns once it has.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(json.dumps({'op': op}).encode('utf-8') + b'\n')
+            chunks = []
+            while True:
+                chunk = sock.recv(1 << 16)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            reply = json.loads(b''.join(chunks)) if chunks else None
+            if op == 'drain' and reply and reply.get('ok'):
+                sock.sendall(b'{"op": "confirm"}\n')
+                # Closed once the other instance has let go of the socket path
+                sock.recv(1)
+    except (OSError, ValueError) as e:
+        logger.info(f"No previous instance on {path}: {e}")
+        return None
+    return reply
+
+
+class HandoverServer:
+    """Serves this instance's warm state to its successor over a unix socket
+
+    The handover has two phases so the old instance keeps serving until the
+    new one can take over. The successor first sends {"op": "state"} and
+    gets the warm state while this instance carries on as before. Once it is
+    connected and listening, it sends {"op": "drain"}. This instance
+    acknowledges and waits for the successor to confirm it got the ack; only
+    then does it stop listening and call on_handover, which starts draining.
+    If the exchange fails, it keeps listening and serving.
+    """
+
+    def __init__(self, path: str, export_state, on_handover):
+        self.path = path
+        self.export_state = export_state
+        self.on_handover = on_handover
+        self._sock: Optional[socket.socket] = None
+        self._inode: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            # Left behind by an instance that exited without handing over
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        self._inode = os.stat(self.path).st_ino
+        os.chmod(self.path, 0o600)
+        self._sock.listen(1)
+        self._sock.settimeout(1.0)
+        self._thread = threading.Thread(target=self._run, name='handover', daemon=True)
+        self._thread.start()
+        logger.info(f"Handover socket listening on {self.path}")
+
+    def stop(self):
+        sock, self._sock = self._sock, None
+        if sock is None:
+            return
+        sock.close()
+        try:
+            # The successor may already have bound its own socket at this path
+            if os.stat(self.path).st_ino == self._inode:
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _run(self):
+        while self._sock is not None:
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            with conn, conn.makefile('rb') as reader:
+                try:
+                    conn.settimeout(10.0)
+                    op = json.loads(reader.readline() or b'{}').get('op')
+                    if op == 'state':
+                        conn.sendall(json.dumps(self.export_state()).encode('utf-8'))
+                        logger.info("Sent warm state to the next instance")
+                        continue
+                    if op != 'drain':
+                        continue
+                    conn.sendall(b'{"ok": true}')
+                    conn.shutdown(socket.SHUT_WR)
+                    if json.loads(reader.readline() or b'{}').get('op') != 'confirm':
+                        logger.error("Next instance did not confirm the handover, still serving")
+                        continue
+                    self.stop()
+                except Exception as e:
+                    logger.error(f"Handover failed, still serving: {e}")
+                    continue
+            logger.info("Handed over to the next instance")
+            self.on_handover()
+            return
+
+
+def complete_handover(path: str, manager, http_port: int, on_complete):
+    """Second handover phase, run in a thread by the instance taking over
+
+    Waits until this instance has its own device list from MeshCentral and
+    accepts HTTP connections, then tells the previous one to drain. Until
+    then the previous instance keeps serving.
+    """
+    while not (manager.authenticated and not manager.warm_state):
+        time.sleep(0.5)
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', http_port), timeout=1.0).close()
+            break
+        except OSError:
+            time.sleep(0.5)
+    for attempt in range(3):
+        if handover_request(path, 'drain'):
+            break
+        time.sleep(2.0)
+    else:
+        # Unreachable or gone; take over the socket so the next deploy finds us
+        logger.warning("Previous instance did not acknowledge the handover")
+    on_complete()
+
+
+drain_controller = DrainController()
+
+
 class MeshCentralWebSocketManager:
     """Manages persistent WebSocket connection to MeshCentral"""
 
     def __init__(self, url: str, username: str, password: str):
-        self.url = url if url.startswith('wss://') else f'wss://{url}/control.ashx'
+        self.url = url if url.startswith(('wss://', 'ws://')) else f'wss://{url}/control.ashx'
         self.username = username
         self.password = password
         self.ws = None
@@ -48,8 +1615,22 @@ class MeshCentralWebSocketManager:
         self._lock = threading.Lock()
         self.response_queues: Dict[str, queue.Queue] = {}
         self.devices = {}
+        self.mesh_names: Dict[str, str] = {}
+        self._nodes: Dict[str, Dict] = {}
+        # Serving a previous instance's device list until our own 'nodes' arrives
+        self.warm_state = False
+        self.index = DeviceIndex()
+        self.latency = DeviceLatencyTracker(
+            LATENCY_EWMA_ALPHA, MIN_COMMAND_TIMEOUT, COMMAND_TIMEOUT, STUCK_DEVICE_TIMEOUTS
+        )
+        self.command_cache = CommandResultCache(COMMAND_CACHE_SIZE, COMMAND_CACHE_TTL)
+        self.scheduler = OutboundScheduler(self._send_now, SEND_LANE_WEIGHTS)
+        self.link_stats = UpstreamLinkStats()
         self.listener_thread = None
         self.should_run = True
+        self.recorder = TrafficRecorder(TRAFFIC_RECORD_PATH, TRAFFIC_RECORD_REDACT_KEYS) if TRAFFIC_RECORD_PATH else None
+        if self.recorder:
+            logger.info(f"Recording MeshCentral traffic to {TRAFFIC_RECORD_PATH}")
 
     def _create_auth_header(self):
         """Create x-meshauth header with base64 encoded credentials"""
@@ -57,21 +1638,35 @@ class MeshCentralWebSocketManager:
         password_b64 = base64.b64encode(self.password.encode()).decode()
         return f"{username_b64},{password_b64}"
 
+    def _create_ws_app(self):
+        """WebSocketApp, or its permessage-deflate counterpart with UPSTREAM_COMPRESSION"""
+        header = [f"x-meshauth: {self._create_auth_header()}"]
+        if UPSTREAM_COMPRESSION and ws_connect is not None:
+            return DeflateWebSocketApp(
+                self.url, header,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_error=self._on_error,
+                on_close=self._on_close,
+                stats=self.link_stats
+            )
+        if UPSTREAM_COMPRESSION:
+            logger.warning("UPSTREAM_COMPRESSION needs the websockets package, using an uncompressed link")
+        return websocket.WebSocketApp(
+            self.url,
+            header=header,
+            on_message=self._on_message,
+            on_error=self._on_error,
+            on_close=self._on_close,
+            on_open=self._on_open
+        )
+
     def connect(self):
         """Establish WebSocket connection"""
         try:
             logger.info(f"Connecting to MeshCentral WebSocket: {self.url}")
 
-            auth_header = self._create_auth_header()
-
-            self.ws = websocket.WebSocketApp(
-                self.url,
-                header=[f"x-meshauth: {auth_header}"],
-                on_message=self._on_message,
-                on_error=self._on_error,
-                on_close=self._on_close,
-                on_open=self._on_open
-            )
+            self.ws = self._create_ws_app()
 
             # Start listener in background thread
             self.listener_thread = threading.Thread(target=self._run_forever, daemon=True)
@@ -98,16 +1693,8 @@ class MeshCentralWebSocketManager:
                     logger.info("WebSocket disconnected, reconnecting in 5s...")
                     time.sleep(5)
                     # Recreate WebSocket object for reconnection
-                    auth_header = self._create_auth_header()
                     with self._lock:
-                        self.ws = websocket.WebSocketApp(
-                            self.url,
-                            header=[f"x-meshauth: {auth_header}"],
-                            on_message=self._on_message,
-                            on_error=self._on_error,
-                            on_close=self._on_close,
-                            on_open=self._on_open
-                        )
+                        self.ws = self._create_ws_app()
             except Exception as e:
                 logger.error(f"WebSocket run error: {e}")
                 time.sleep(5)
@@ -116,28 +1703,46 @@ class MeshCentralWebSocketManager:
         """Handle WebSocket connection established"""
         logger.info("WebSocket connection established")
         self.connected = True
-        # Request device list
-        ws.send(json.dumps({'action': 'nodes'}))
+        # Request device list, and mesh names for selectors (nodes only has mesh ids)
+        self._send({'action': 'nodes'}, wait=False)
+        self._send({'action': 'meshes'}, wait=False)
 
     def _on_message(self, ws, message):
         """Handle incoming WebSocket messages"""
         try:
+            decode_start = time.monotonic()
             data = json.loads(message)
+            decode_time = time.monotonic() - decode_start
             action = data.get('action', 'unknown')
 
+            if self.recorder:
+                self.recorder.record('in', data)
+            if not isinstance(ws, DeflateWebSocketApp):
+                size = text_size(message)
+                self.link_stats.add_received(size, size, messages=1)
+
             # Handle nodes list - means we're authenticated
             if action == 'nodes':
                 if 'nodes' in data:
                     self.devices = data['nodes']
+                    self._index_devices()
                     self.authenticated = True
+                    self.warm_state = False
                     logger.info(f"Authenticated! Received {len(self.devices)} device groups")
 
+            elif action == 'meshes':
+                self.mesh_names = {
+                    mesh['_id']: mesh.get('name', '')
+                    for mesh in data.get('meshes', []) if isinstance(mesh, dict) and '_id' in mesh
+                }
+                self._index_devices()
+
             # Handle authentication response
             elif action == 'authcookie':
                 self.authenticated = True
                 logger.info("WebSocket authenticated successfully")
                 # Request device list
-                self._send({'action': 'nodes'})
+                self._send({'action': 'nodes'}, wait=False)
 
             # Handle close/error messages
             elif action == 'close':
@@ -150,13 +1755,24 @@ class MeshCentralWebSocketManager:
             # Handle event updates (device status changes)
             elif action == 'event':
                 event = data.get('event', {})
-                if event.get('action') in ['addnode', 'changenode']:
+                if event.get('action') in ['addnode', 'changenode', 'removenode']:
                     # Refresh device list
-                    self._send({'action': 'nodes'})
+                    self._send({'action': 'nodes'}, wait=False)
+                elif event.get('action') in ['createmesh', 'meshchange', 'deletemesh']:
+                    self._send({'action': 'meshes'}, wait=False)
+                elif event.get('action') == 'nodeconnect':
+                    # Keep the online bit current between full refreshes
+                    device = self._nodes.get(event.get('nodeid'))
+                    if device is not None and 'conn' in event:
+                        device['conn'] = event['conn']
+                        self.index.set_online(device['_id'], (event['conn'] & 1) != 0)
 
             # Route responses to waiting queues
             msg_id = data.get('responseid') or data.get('tag')
             if msg_id and msg_id in self.response_queues:
+                trace = trace_exporter.active.get(str(msg_id).partition(':')[0])
+                if trace is not None:
+                    trace.add_span('ws.json_decode', decode_start, decode_time, bytes=len(message))
                 self.response_queues[msg_id].put(data)
 
         except json.JSONDecodeError:
@@ -174,44 +1790,213 @@ class MeshCentralWebSocketManager:
         self.connected = False
         self.authenticated = False
 
-    def _send(self, data: Dict) -> bool:
+    def _send(self, data: Dict, lane: str = 'normal', wait: bool = True) -> bool:
+        """Queue a message on a priority lane and, by default, wait until it was sent
+
+        The WebSocket callbacks pass wait=False so the listener thread never
+        blocks behind queued traffic.
+        """
+        item = self.scheduler.submit(data, lane)
+        if not wait:
+            return True
+        if not item['done'].wait(SEND_QUEUE_TIMEOUT):
+            if self.scheduler.cancel(item):
+                logger.error(f"Send queue timeout on lane {lane}")
+                return False
+            # Already being written; report what actually happened
+            item['done'].wait()
+        return item['ok']
+
+    def _send_now(self, data: Dict) -> bool:
         """Send message via WebSocket"""
         try:
             with self._lock:
-                if self.ws and self.connected:
-                    self.ws.send(json.dumps(data))
-                    return True
-            return False
+                if not (self.ws and self.connected):
+                    return False
+                message = json.dumps(data)
+                sent_at = time.monotonic()
+                self.ws.send(message)
+                if not isinstance(self.ws, DeflateWebSocketApp):
+                    size = text_size(message)
+                    self.link_stats.add_sent(size, size, messages=1)
+            # Recording redacts and writes to disk, so it stays off the send lock
+            if self.recorder:
+                trace = trace_exporter.active.get(str(data.get('responseid', '')).partition(':')[0])
+                origin = {'key': trace.key, 'route': f"{trace.method} {trace.path}"} if trace else None
+                self.recorder.record('out', json.loads(message), origin, at=sent_at)
+            return True
         except Exception as e:
             logger.error(f"Send error: {e}")
             return False
 
-    def send_and_wait(self, data: Dict, timeout: int = 10) -> Optional[Dict]:
-        """Send message and wait for response"""
+    def send_and_wait(self, data: Dict, timeout: float = 10,
+                      hedge_after: Optional[float] = None, lane: str = 'normal') -> Optional[Dict]:
+        """Send message and wait for response
+
+        If hedge_after is set and no response arrived by then, the message is
+        sent once more under a new responseid and whichever reply comes first
+        wins. Only use it for requests that are safe to repeat.
+        """
+        return self._exchange(data, timeout, hedge_after, lane)[1]
+
+    def _exchange(self, data: Dict, timeout: float, hedge_after: Optional[float],
+                  lane: str) -> Tuple[bool, Optional[Dict]]:
+        """send_and_wait that also tells whether the message went out at all"""
         if not self.connected or not self.authenticated:
-            return None
+            return False, None
 
         # Add unique message ID using MeshCentral's responseid system
-        msg_id = str(uuid.uuid4())
+        msg_id = new_message_id()
         data['responseid'] = msg_id
+        msg_ids = [msg_id]
 
         # Create response queue
         response_queue = queue.Queue()
         self.response_queues[msg_id] = response_queue
 
-        # Send message
-        if not self._send(data):
-            self.response_queues.pop(msg_id, None)
-            return None
+        try:
+            # Send message
+            if not self._send(data, lane):
+                return False, None
+
+            # Wait for response
+            with trace_span('meshcentral.roundtrip', action=data.get('action'), hedged=hedge_after is not None):
+                if hedge_after is not None and hedge_after < timeout:
+                    try:
+                        return True, response_queue.get(timeout=hedge_after)
+                    except queue.Empty:
+                        hedge_id = new_message_id()
+                        msg_ids.append(hedge_id)
+                        self.response_queues[hedge_id] = response_queue
+                        logger.info(f"Hedging {data.get('action')} after {hedge_after:.1f}s")
+                        self._send(dict(data, responseid=hedge_id), lane)
+                        timeout -= hedge_after
+
+                try:
+                    return True, response_queue.get(timeout=timeout)
+                except queue.Empty:
+                    return True, None
+        finally:
+            for pending_id in msg_ids:
+                self.response_queues.pop(pending_id, None)
+
+    def send_and_collect(self, data: Dict, expected: int, timeout: float = 10,
+                         lane: str = 'normal') -> List[Dict]:
+        """Send a multi-node message and gather replies until every node answered
 
-        # Wait for response
+        Replies are told apart by their nodeid; replies without one only
+        count when a single node was addressed.
+        """
+        if not self.connected or not self.authenticated:
+            return []
+
+        msg_id = new_message_id()
+        data['responseid'] = msg_id
+        response_queue = queue.Queue()
+        self.response_queues[msg_id] = response_queue
+
+        replies = []
+        answered = set()
         try:
-            return response_queue.get(timeout=timeout)
-        except queue.Empty:
-            return None
+            if not self._send(data, lane):
+                return []
+
+            deadline = time.monotonic() + timeout
+            while len(answered) < expected:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    reply = response_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                node_id = reply.get('nodeid')
+                if node_id is None and expected > 1:
+                    continue
+                answered.add(node_id)
+                replies.append(reply)
+            return replies
         finally:
             self.response_queues.pop(msg_id, None)
 
+    def _timed_request(self, node_id: str, kind: str, msg: Dict, hedge: bool = False,
+                       lane: str = 'normal', adaptive: bool = True) -> Optional[Dict]:
+        """Send a device request and record its latency
+
+        adaptive=False keeps the full COMMAND_TIMEOUT. runcommands can't be
+        cancelled, so cutting an arbitrary command short only leads clients to
+        retry it while the first run is still going.
+
+        Only requests that were sent and then went unanswered count against
+        the device; proxy-side failures leave its stats alone.
+        """
+        timeout = self.latency.timeout_for(node_id, kind) if adaptive else COMMAND_TIMEOUT
+        hedge_after = self.latency.hedge_after(node_id, kind) if hedge else None
+
+        start = time.monotonic()
+        sent, response = self._exchange(msg, timeout, hedge_after, lane)
+        elapsed = time.monotonic() - start
+
+        if response is not None:
+            self.latency.record(node_id, kind, elapsed)
+        elif not sent:
+            logger.warning(f"{kind} to {node_id} was not sent")
+        elif self.connected:
+            self.latency.record_timeout(node_id, kind, elapsed)
+            logger.warning(f"{kind} to {node_id} timed out after {elapsed:.1f}s")
+        return response
+
+    def _index_devices(self):
+        """Rebuild the node id lookup from the mesh-grouped device list"""
+        nodes = {}
+        for devices_in_mesh in self.devices.values():
+            if isinstance(devices_in_mesh, list):
+                for device in devices_in_mesh:
+                    if device.get('_id'):
+                        nodes[device['_id']] = device
+        self._nodes = nodes
+        self.index.rebuild(self.devices, self.mesh_names)
+
+    def pending_responses(self) -> int:
+        """MeshCentral responses still being waited for"""
+        return len(self.response_queues)
+
+    def export_state(self) -> Dict[str, Any]:
+        """Warm state handed to the next instance on a rolling deploy"""
+        return {
+            'devices': self.devices,
+            'mesh_names': self.mesh_names,
+            'latency': self.latency.export_state(),
+            'command_cache': self.command_cache.export_state()
+        }
+
+    def load_state(self, state: Dict[str, Any]):
+        """Start from a previous instance's state until the own nodes sync arrives"""
+        if state.get('devices') and not self.devices:
+            self.devices = state['devices']
+            self.mesh_names = state.get('mesh_names') or {}
+            self._index_devices()
+            self.warm_state = True
+        self.latency.load_state(state.get('latency', []))
+        self.command_cache.load_state(state.get('command_cache', []))
+        logger.info(f"Took over {len(self._nodes)} devices, {len(state.get('latency', []))} latency "
+                    f"entries and {len(state.get('command_cache', []))} cached results")
+
+    def can_list_devices(self) -> bool:
+        """Whether the device list is usable: authenticated, or handed over and still syncing"""
+        return self.authenticated or self.warm_state
+
+    def get_device(self, node_id: str) -> Optional[Dict]:
+        """Raw MeshCentral node record for a node id"""
+        return self._nodes.get(node_id)
+
+    def device_state(self, node_id: str) -> str:
+        """Return 'online', 'offline' or 'unknown' for a node id"""
+        device = self._nodes.get(node_id)
+        if device is None:
+            return 'unknown'
+        return 'online' if (device.get('conn', 0) & 1) != 0 else 'offline'
+
     def get_devices_list(self) -> List[Dict]:
         """Get list of all devices in simple format"""
         devices_list = []
@@ -236,29 +2021,137 @@ class MeshCentralWebSocketManager:
 
         return devices_list
 
-    def execute_command(self, node_id: str, command: str) -> Optional[Dict]:
-        """Execute shell command on device"""
-        msg = {
-            'action': 'runcommands',
-            'nodeids': [node_id],
-            'type': 0,  # 0=shell, 1=cmd, 2=powershell
-            'cmds': command,
-            'runAsUser': 0  # 0=run as root/agent, 1=run as logged-in user
-        }
-        return self.send_and_wait(msg, timeout=150)
+    def execute_command(self, node_id: str, command: str, command_type: int = 0,
+                        lane: str = 'normal', adaptive: bool = False) -> Optional[Dict]:
+        """Execute shell command on device
+
+        Only idempotent commands and scripts pass adaptive=True to use the
+        per-device timeout; anything else gets COMMAND_TIMEOUT.
+        """
+        if self.device_state(node_id) != 'online':
+            return None
+
+        msg = runcommands_message([node_id], command, command_type)
+        return self._timed_request(node_id, 'command', msg, lane=lane, adaptive=adaptive)
+
+    def execute_command_cached(self, node_id: str, command: str,
+                               ttl: Optional[float] = None) -> Tuple[Optional[Dict], str]:
+        """Execute an idempotent command, serving repeats from the result cache"""
+        return self.command_cache.get_or_run(
+            (node_id, command.strip()),
+            lambda: self.execute_command(node_id, command, adaptive=True),
+            ttl
+        )
+
+    def run_script(self, node_id: str, script: ScriptDefinition, params: Dict[str, Any],
+                   use_cache: bool = True, ttl: Optional[float] = None) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Run a registry script and parse its output
+
+        Returns (result, cache status). Raises ValueError for invalid
+        parameters or an unsupported OS.
+        """
+        family = os_family((self.get_device(node_id) or {}).get('osdesc'))
+        command_type, command, parser = script.render(family, params)
+
+        def run():
+            response = self.execute_command(node_id, command, command_type, adaptive=True)
+            if response is None:
+                return None
+            output = response.get('result', response.get('value', ''))
+            try:
+                parsed = parser(output)
+            except Exception as e:
+                # Raising keeps unparseable output out of the cache
+                raise ScriptOutputError(f"Could not parse {script.name} output: {e}", output)
+            return {'os_family': family, 'parsed': parsed, 'output': output}
+
+        if not use_cache:
+            return run(), None
+
+        key = (node_id, 'script', script.name, json.dumps(params, sort_keys=True))
+        return self.command_cache.get_or_run(key, run, ttl if ttl is not None else script.cache_ttl)
+
+    def _run_batched(self, node_ids: List[str], msg_for, kind: str, lane: str,
+                     adaptive: bool = True) -> Dict[str, Optional[Dict]]:
+        """Send msg_for(batch) per batch of nodes in parallel and collect replies by node id
+
+        Like _timed_request, batches wait COMMAND_TIMEOUT unless adaptive.
+        """
+        results: Dict[str, Optional[Dict]] = {node_id: None for node_id in node_ids}
+        batches = [node_ids[i:i + SELECTOR_BATCH_SIZE] for i in range(0, len(node_ids), SELECTOR_BATCH_SIZE)]
+
+        def run(batch):
+            if adaptive:
+                timeout = max(self.latency.timeout_for(node_id, kind) for node_id in batch)
+            else:
+                timeout = COMMAND_TIMEOUT
+            for reply in self.send_and_collect(msg_for(batch), len(batch), timeout, lane):
+                node_id = reply.get('nodeid') or (batch[0] if len(batch) == 1 else None)
+                if node_id in results:
+                    results[node_id] = reply
+
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(len(batches), 8)) as pool:
+                # Each batch runs in a copy of this context so it keeps the request's trace
+                futures = [pool.submit(copy_context().run, run, batch) for batch in batches]
+                for future in futures:
+                    future.result()
+        return results
+
+    def execute_command_many(self, node_ids: List[str], command: str, command_type: int = 0,
+                             lane: str = 'normal', adaptive: bool = False) -> Dict[str, Optional[Dict]]:
+        """Run one command on many devices; None for devices that didn't answer"""
+        return self._run_batched(node_ids, lambda batch: runcommands_message(batch, command, command_type),
+                                 'command', lane, adaptive)
+
+    def run_script_many(self, node_ids: List[str], script: ScriptDefinition,
+                        params: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Run a registry script on many devices, one variant per OS family
+
+        Each result has os_family and either parsed and output, or error.
+        Results are not cached.
+        """
+        by_family: Dict[str, List[str]] = {}
+        for node_id in node_ids:
+            by_family.setdefault(os_family((self.get_device(node_id) or {}).get('osdesc')), []).append(node_id)
+
+        results: Dict[str, Dict[str, Any]] = {}
+        for family, family_nodes in by_family.items():
+            try:
+                command_type, command, parser = script.render(family, params)
+            except ValueError as e:
+                results.update({node_id: {'os_family': family, 'error': str(e)} for node_id in family_nodes})
+                continue
+
+            for node_id, reply in self.execute_command_many(family_nodes, command, command_type,
+                                                            adaptive=True).items():
+                if reply is None:
+                    results[node_id] = {'os_family': family, 'error': "Command timeout or failed"}
+                    continue
+                output = reply.get('result', reply.get('value', ''))
+                try:
+                    results[node_id] = {'os_family': family, 'parsed': parser(output), 'output': output}
+                except Exception as e:
+                    results[node_id] = {'os_family': family, 'error': f"Could not parse {script.name} output: {e}",
+                                        'output': output}
+        return results
 
     def get_screenshot(self, node_id: str) -> Optional[bytes]:
         """Request screenshot from device"""
+        if self.device_state(node_id) != 'online':
+            return None
+
         msg = {
             'action': 'msg',
             'nodeid': node_id,
             'type': 'screenshot'
         }
-        response = self.send_and_wait(msg, timeout=150)
+        response = self._timed_request(node_id, 'screenshot', msg, hedge=True, lane='interactive')
 
         if response and 'data' in response:
             try:
-                return base64.b64decode(response['data'])
+                with trace_span('screenshot.base64_decode', bytes=len(response['data'])):
+                    return base64.b64decode(response['data'])
             except Exception as e:
                 logger.error(f"Screenshot decode error: {e}")
         return None
@@ -269,12 +2162,32 @@ class MeshCentralWebSocketManager:
         with self._lock:
             if self.ws:
                 self.ws.close()
+        self.scheduler.stop()
+        if self.recorder:
+            self.recorder.close()
+
+
+def start_drain(reason: str, timeout: float = DRAIN_TIMEOUT, exit_after: bool = False) -> bool:
+    """Start draining in the background, optionally stopping the process once done"""
+    if not drain_controller.start(timeout, reason):
+        return False
+    if telemetry_collector:
+        telemetry_collector.stop()
+
+    def run():
+        drain_controller.wait(ws_manager.pending_responses if ws_manager else lambda: 0)
+        if exit_after:
+            # uvicorn handles SIGTERM as a graceful shutdown
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    threading.Thread(target=run, name='drain', daemon=True).start()
+    return True
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup and shutdown"""
-    global ws_manager
+    global ws_manager, telemetry_collector, handover_server
 
     # Startup
     logger.info("=" * 60)
@@ -295,9 +2208,18 @@ async def lifespan(app: FastAPI):
         raise RuntimeError(f"Missing required environment variables: {', '.join(missing)}")
 
     # Initialize WebSocket manager
-    WS_URL = f'wss://{MESHCENTRAL_URL}/control.ashx' if not MESHCENTRAL_URL.startswith('wss://') else MESHCENTRAL_URL
+    WS_URL = f'wss://{MESHCENTRAL_URL}/control.ashx' if not MESHCENTRAL_URL.startswith(('wss://', 'ws://')) else MESHCENTRAL_URL
     ws_manager = MeshCentralWebSocketManager(WS_URL, MESHCENTRAL_USERNAME, MESHCENTRAL_PASSWORD)
 
+    # Take over warm state from the instance this one replaces; it keeps
+    # serving until this one is ready (see complete_handover)
+    took_over = False
+    if HANDOVER_SOCKET:
+        state = await run_in_threadpool(handover_request, HANDOVER_SOCKET, 'state')
+        if state:
+            ws_manager.load_state(state)
+            took_over = True
+
     # Connect in background
     threading.Thread(target=ws_manager.connect, daemon=True).start()
 
@@ -309,10 +2231,36 @@ async def lifespan(app: FastAPI):
     else:
         logger.error("Failed to connect to MeshCentral - check credentials")
 
+    if TELEMETRY_ENABLED:
+        telemetry_collector = TelemetryCollector(
+            ws_manager, telemetry_store, TELEMETRY_METRICS, TELEMETRY_INTERVAL, TELEMETRY_BATCH_SIZE
+        )
+        telemetry_collector.start()
+
+    if HANDOVER_SOCKET:
+        handover_server = HandoverServer(
+            HANDOVER_SOCKET, ws_manager.export_state,
+            lambda: start_drain('handed over to the next instance', exit_after=True)
+        )
+        if took_over:
+            threading.Thread(
+                target=complete_handover, name='handover-complete', daemon=True,
+                args=(HANDOVER_SOCKET, ws_manager, int(os.getenv('PORT', 8000)), handover_server.start)
+            ).start()
+        else:
+            handover_server.start()
+
     yield
 
-    # Shutdown
+    # Shutdown: let in-flight requests finish before closing the MeshCentral link
+    if handover_server:
+        handover_server.stop()
+    if telemetry_collector:
+        telemetry_collector.stop()
     if ws_manager:
+        drain_controller.start(DRAIN_TIMEOUT, 'shutdown')
+        if not drain_controller.finished:
+            await run_in_threadpool(drain_controller.wait, ws_manager.pending_responses)
         ws_manager.disconnect()
 
 
@@ -326,11 +2274,88 @@ app = FastAPI(
 
 # Request/Response models
 class CommandRequest(BaseModel):
-    device_id: str
+    device_id: Optional[str] = None
+    selector: Optional[str] = None  # Run on every online device matching it instead
     command: str
+    idempotent: Optional[bool] = None  # None = decide from the allowlist
+    cache_ttl: Optional[float] = None  # Seconds, defaults to COMMAND_CACHE_TTL
+    lean: bool = False  # Leave out the command echo and raw_response
 
 class ScreenshotRequest(BaseModel):
-    device_id: str
+    device_id: Optional[str] = None
+    selector: Optional[str] = None  # Must match exactly one device
+
+
+def dump_json(payload: Any) -> bytes:
+    """Serialize a response payload, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the best supported content encoding from an Accept-Encoding header"""
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    available = []
+    if zstandard is not None:
+        available.append('zstd')
+    if brotli is not None:
+        available.append('br')
+    available.append('gzip')
+
+    candidates = [name for name in available if accepted.get(name, accepted.get('*', 0.0)) > 0]
+    if not candidates:
+        return None
+    # Highest q-value wins, ties go to the stronger/faster codec
+    return max(candidates, key=lambda name: (accepted.get(name, accepted.get('*', 0.0)), -available.index(name)))
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """Compress a response body with the given content encoding"""
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def json_response(payload: Any, accept_encoding: Optional[str] = None, status_code: int = 200,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    """Build a JSON response, compressed when large enough and accepted"""
+    with trace_span('response.serialize'):
+        body = dump_json(payload)
+    headers = dict(headers or {}, Vary='Accept-Encoding')
+
+    if len(body) >= COMPRESSION_MIN_SIZE:
+        encoding = choose_encoding(accept_encoding)
+        if encoding:
+            with trace_span('response.compress', encoding=encoding, bytes=len(body)):
+                body = compress_body(body, encoding)
+            headers['Content-Encoding'] = encoding
+
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+def lean_device(device: Dict) -> Dict:
+    """Drop placeholder fields from a device entry"""
+    return {
+        key: value for key, value in device.items()
+        if not (key == 'ip' and value == 'N/A') and not (key == 'os' and value == 'Unknown OS')
+    }
 
 
 def verify_api_key(x_api_key: str = Header(None)):
@@ -340,54 +2365,225 @@ def verify_api_key(x_api_key: str = Header(None)):
     return x_api_key
 
 
+def verify_admin_key(x_api_key: str = Header(None)):
+    """Verify API key for admin endpoints"""
+    if x_api_key != ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid API key")
+    return x_api_key
+
+
+def require_online_device(device_id: str):
+    """Fail fast for devices that are unknown or offline"""
+    state = ws_manager.device_state(device_id)
+    if state == 'unknown':
+        raise HTTPException(status_code=404, detail=f"Unknown device: {device_id}")
+    if state == 'offline':
+        raise HTTPException(status_code=409, detail=f"Device is offline: {device_id}")
+
+
+def require_one_target(device_id: Optional[str], selector: Optional[str]):
+    """A request addresses either one device_id or a selector"""
+    if (device_id is None) == (selector is None):
+        raise HTTPException(status_code=400, detail="Give either device_id or selector")
+
+
+def select_devices(selector: str, online_only: bool = False, limit: Optional[int] = MAX_SELECTOR_DEVICES) -> List[str]:
+    """Resolve a selector to sorted node ids, raising 400 for bad or too broad selectors"""
+    try:
+        node_ids = ws_manager.index.resolve(selector, online_only)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if limit is not None and len(node_ids) > limit:
+        raise HTTPException(status_code=400,
+                            detail=f"Selector matches {len(node_ids)} devices, the limit is {limit}")
+    return sorted(node_ids)
+
+
 # API Endpoints
 
+# Paths still served while draining, so the drain can be observed and controlled
+DRAIN_EXEMPT_PATHS = ('/health', '/stats', '/admin/')
+
+
+@app.middleware("http")
+async def track_in_flight(request: Request, call_next):
+    """Count in-flight requests and turn new work away while draining"""
+    if request.url.path.startswith(DRAIN_EXEMPT_PATHS):
+        return await call_next(request)
+
+    if not drain_controller.enter():
+        return json_response({
+            "success": False,
+            "detail": "Proxy is draining, retry on another instance"
+        }, None, status_code=503, headers={'Retry-After': '1'})
+    try:
+        return await call_next(request)
+    finally:
+        drain_controller.exit()
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Open a trace per request; the id comes from X-Trace-Id or is generated"""
+    trace_id = request.headers.get('x-trace-id', '')
+    if not re.match(r'^[A-Za-z0-9_\-]{1,64}$', trace_id):
+        trace_id = uuid.uuid4().hex
+
+    trace = Trace(trace_id, request.method, request.url.path)
+    token = current_trace.set(trace)
+    trace_exporter.active[trace.key] = trace
+    if ws_manager and ws_manager.recorder and not request.url.path.startswith(DRAIN_EXEMPT_PATHS):
+        body = await request.body()
+        try:
+            body = json.loads(body) if body else None
+        except ValueError:
+            body = None
+        ws_manager.recorder.record_request(trace.key, request.method, request.url.path,
+                                           request.url.query, body)
+    status = None
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers['X-Trace-Id'] = trace_id
+        return response
+    finally:
+        current_trace.reset(token)
+        trace_exporter.active.pop(trace.key, None)
+        trace.finish(status)
+        if request.url.path != '/health':
+            trace_exporter.export(trace)
+
+
 @app.get("/health")
 async def health():
-    """Health check endpoint"""
-    return {
-        "status": "healthy" if (ws_manager and ws_manager.authenticated) else "degraded",
+    """Health check endpoint; answers 503 while draining so load balancers move on"""
+    if drain_controller.draining:
+        status = "draining"
+    else:
+        status = "healthy" if (ws_manager and ws_manager.authenticated) else "degraded"
+
+    return json_response({
+        "status": status,
         "connected": ws_manager.connected if ws_manager else False,
         "authenticated": ws_manager.authenticated if ws_manager else False,
+        "drain": drain_controller.status(ws_manager.pending_responses() if ws_manager else 0),
         "version": "1.0.6"
-    }
+    }, None, status_code=503 if drain_controller.draining else 200)
+
+
+@app.get("/stats")
+async def stats(x_api_key: str = Header(None), accept_encoding: str = Header(None)):
+    """Per-device latency, timeout and stuck-device stats"""
+    verify_api_key(x_api_key)
+
+    if ws_manager is None:
+        raise HTTPException(status_code=503, detail="Not connected to MeshCentral")
+
+    latency = ws_manager.latency.snapshot()
+
+    return json_response({
+        "success": True,
+        "latency": latency,
+        "command_cache": ws_manager.command_cache.stats(),
+        "send_lanes": ws_manager.scheduler.stats(),
+        "device_index": ws_manager.index.stats(),
+        "upstream_link": ws_manager.link_stats.snapshot(),
+        "telemetry": telemetry_collector.stats() if telemetry_collector else None,
+        "stuck_devices": sorted({entry['device_id'] for entry in latency if entry['stuck']})
+    }, accept_encoding)
 
 
 @app.get("/getDevices")
-async def get_devices(x_api_key: str = Header(None)):
-    """Get list of all available devices"""
+async def get_devices(lean: bool = False, selector: Optional[str] = None, x_api_key: str = Header(None),
+                      accept_encoding: str = Header(None)):
+    """Get list of all available devices, or those matching a selector"""
     verify_api_key(x_api_key)
 
-    if ws_manager is None or not ws_manager.authenticated:
+    if ws_manager is None or not ws_manager.can_list_devices():
         raise HTTPException(status_code=503, detail="Not connected to MeshCentral")
 
     devices = ws_manager.get_devices_list()
+    if selector is not None:
+        selected = set(select_devices(selector, limit=None))
+        devices = [device for device in devices if device['id'] in selected]
 
-    return {
+    if lean:
+        return json_response({
+            "success": True,
+            "devices": [lean_device(device) for device in devices]
+        }, accept_encoding)
+
+    return json_response({
         "success": True,
         "count": len(devices),
         "devices": devices
-    }
+    }, accept_encoding)
 
 
 @app.post("/sendCommand")
-async def send_command(request: CommandRequest, x_api_key: str = Header(None)):
+async def send_command(request: CommandRequest, x_api_key: str = Header(None),
+                       accept_encoding: str = Header(None)):
     """Send command to a device"""
     verify_api_key(x_api_key)
 
     if ws_manager is None or not ws_manager.authenticated:
         raise HTTPException(status_code=503, detail="Not connected to MeshCentral")
 
-    result = ws_manager.execute_command(request.device_id, request.command)
+    require_one_target(request.device_id, request.selector)
+    if request.selector is not None:
+        node_ids = select_devices(request.selector, online_only=True)
+        replies = await run_in_threadpool(ws_manager.execute_command_many, node_ids, request.command)
+        results = []
+        for node_id, reply in replies.items():
+            if reply is None:
+                results.append({"device_id": node_id, "success": False, "error": "Command timeout or failed"})
+            else:
+                results.append({
+                    "device_id": node_id,
+                    "success": True,
+                    "output": reply.get('result', reply.get('value', ''))
+                })
+        return json_response({
+            "success": True,
+            "selector": request.selector,
+            "matched": len(node_ids),
+            "answered": sum(1 for result in results if result['success']),
+            "results": results
+        }, accept_encoding)
+
+    require_online_device(request.device_id)
+
+    cacheable = request.idempotent
+    if cacheable is None:
+        cacheable = is_idempotent_command(request.command)
+
+    cache_status = None
+    if cacheable:
+        result, cache_status = await run_in_threadpool(
+            ws_manager.execute_command_cached, request.device_id, request.command, request.cache_ttl
+        )
+    else:
+        result = await run_in_threadpool(ws_manager.execute_command, request.device_id, request.command)
 
     if result:
-        return {
-            "success": True,
-            "device_id": request.device_id,
-            "command": request.command,
-            "output": result.get('result', result.get('value', '')),
-            "raw_response": result
-        }
+        output = result.get('result', result.get('value', ''))
+        if request.lean:
+            response = {
+                "success": True,
+                "device_id": request.device_id,
+                "output": output
+            }
+        else:
+            response = {
+                "success": True,
+                "device_id": request.device_id,
+                "command": request.command,
+                "output": output,
+                "raw_response": result
+            }
+        if cache_status:
+            response["cache"] = cache_status
+        return json_response(response, accept_encoding)
     else:
         return {
             "success": False,
@@ -403,7 +2599,18 @@ async def get_screen(request: ScreenshotRequest, x_api_key: str = Header(None)):
     if ws_manager is None or not ws_manager.authenticated:
         raise HTTPException(status_code=503, detail="Not connected to MeshCentral")
 
-    screenshot_data = ws_manager.get_screenshot(request.device_id)
+    require_one_target(request.device_id, request.selector)
+    device_id = request.device_id
+    if request.selector is not None:
+        node_ids = select_devices(request.selector)
+        if len(node_ids) != 1:
+            raise HTTPException(status_code=404 if not node_ids else 400,
+                                detail=f"Selector must match exactly one device, it matches {len(node_ids)}")
+        device_id = node_ids[0]
+
+    require_online_device(device_id)
+
+    screenshot_data = await run_in_threadpool(ws_manager.get_screenshot, device_id)
 
     if screenshot_data:
         return Response(content=screenshot_data, media_type="image/png")
@@ -411,8 +2618,212 @@ async def get_screen(request: ScreenshotRequest, x_api_key: str = Header(None)):
         raise HTTPException(status_code=500, detail="Screenshot capture failed")
 
 
+@app.post("/admin/drain")
+async def drain(timeout: float = DRAIN_TIMEOUT, shutdown: bool = False, x_api_key: str = Header(None)):
+    """Stop taking new work and let in-flight requests finish
+
+    With shutdown=true the process exits once drained or at the deadline.
+    Progress is reported on /health.
+    """
+    verify_admin_key(x_api_key)
+
+    if not start_drain('requested via /admin/drain', timeout, shutdown):
+        raise HTTPException(status_code=409, detail="Already draining")
+
+    return json_response({
+        "success": True,
+        "drain": drain_controller.status(ws_manager.pending_responses() if ws_manager else 0)
+    }, None)
+
+
+@app.get("/admin/traces")
+async def get_traces(limit: int = 50, min_ms: float = 0.0, path: Optional[str] = None,
+                     x_api_key: str = Header(None), accept_encoding: str = Header(None)):
+    """Most recent request traces, newest first, optionally only slow ones"""
+    verify_admin_key(x_api_key)
+
+    traces = trace_exporter.recent(limit, min_ms, path)
+    return json_response({
+        "success": True,
+        "count": len(traces),
+        "traces": traces
+    }, accept_encoding)
+
+
+_profile_lock = threading.Lock()
+
+
+@app.post("/admin/profile")
+async def profile(seconds: float = 10.0, interval_ms: float = 5.0, x_api_key: str = Header(None)):
+    """Sample all thread stacks for N seconds and return folded stacks
+
+    The output is the 'folded' format read by flamegraph.pl, speedscope and
+    inferno: one 'frame;frame;frame count' line per distinct stack.
+    """
+    verify_admin_key(x_api_key)
+
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {MAX_PROFILE_SECONDS}")
+    if not _profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    try:
+        stacks = await run_in_threadpool(sample_stacks, seconds, max(interval_ms, 1.0) / 1000)
+    finally:
+        _profile_lock.release()
+
+    body = '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common())
+    return PlainTextResponse(body + '\n')
+
+
+@app.get("/telemetry")
+async def get_telemetry(device_id: str, metric: str, start: Optional[float] = None, end: Optional[float] = None,
+                        resolution: Optional[int] = None, x_api_key: str = Header(None),
+                        accept_encoding: str = Header(None)):
+    """Time-series range query for one device and metric
+
+    start/end are Unix timestamps (default: the last hour). The finest
+    retained resolution covering start is used unless resolution (seconds)
+    asks for a coarser one.
+    """
+    verify_api_key(x_api_key)
+
+    end = end if end is not None else time.time()
+    start = start if start is not None else end - 3600
+    result = telemetry_store.query(device_id, metric, start, end, resolution)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No {metric} samples for {device_id}")
+
+    return json_response({
+        "success": True,
+        "device_id": device_id,
+        "metric": metric,
+        "resolution": result['resolution'],
+        "points": result['points']
+    }, accept_encoding)
+
+
+@app.get("/telemetry/fleet")
+async def get_fleet_telemetry(metric: Optional[str] = None, selector: Optional[str] = None,
+                              x_api_key: str = Header(None), accept_encoding: str = Header(None)):
+    """Latest sample of each metric for every device, or those matching a selector"""
+    verify_api_key(x_api_key)
+
+    latest = telemetry_store.latest(metric)
+    if selector is not None:
+        if ws_manager is None:
+            raise HTTPException(status_code=503, detail="Not connected to MeshCentral")
+        selected = set(select_devices(selector, limit=None))
+        latest = {node_id: samples for node_id, samples in latest.items() if node_id in selected}
+    return json_response({
+        "success": True,
+        "enabled": telemetry_collector is not None,
+        "count": len(latest),
+        "devices": latest
+    }, accept_encoding)
+
+
+class RunScriptRequest(BaseModel):
+    device_id: Optional[str] = None
+    selector: Optional[str] = None  # Run on every online device matching it instead
+    script: str
+    params: Dict[str, Any] = {}
+    use_cache: bool = True
+    cache_ttl: Optional[float] = None  # Seconds, defaults to the script's own TTL
+    lean: bool = False  # Leave out the raw output
+
+
+@app.get("/scripts")
+async def list_scripts(x_api_key: str = Header(None)):
+    """List registered scripts with their parameters and supported OS families"""
+    verify_api_key(x_api_key)
+
+    return {
+        "success": True,
+        "scripts": [script.describe() for script in SCRIPT_REGISTRY.values()]
+    }
+
+
+@app.post("/runScript")
+async def run_script(request: RunScriptRequest, x_api_key: str = Header(None),
+                     accept_encoding: str = Header(None)):
+    """Run a named script, picking the variant for the device's OS, and return parsed output"""
+    verify_api_key(x_api_key)
+
+    if ws_manager is None or not ws_manager.authenticated:
+        raise HTTPException(status_code=503, detail="Not connected to MeshCentral")
+
+    script = SCRIPT_REGISTRY.get(request.script)
+    if script is None:
+        raise HTTPException(status_code=404, detail=f"Unknown script: {request.script}")
+
+    require_one_target(request.device_id, request.selector)
+    if request.selector is not None:
+        try:
+            script.validate(request.params)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        node_ids = select_devices(request.selector, online_only=True)
+        by_device = await run_in_threadpool(ws_manager.run_script_many, node_ids, script, request.params)
+        results = []
+        for node_id in node_ids:
+            result = by_device[node_id]
+            entry = {"device_id": node_id, "success": 'error' not in result, "os_family": result['os_family']}
+            if 'error' in result:
+                entry["error"] = result['error']
+            else:
+                entry["result"] = result['parsed']
+            if not request.lean and 'output' in result:
+                entry["output"] = result['output']
+            results.append(entry)
+        return json_response({
+            "success": True,
+            "selector": request.selector,
+            "script": script.name,
+            "matched": len(node_ids),
+            "answered": sum(1 for entry in results if entry['success']),
+            "results": results
+        }, accept_encoding)
+
+    require_online_device(request.device_id)
+
+    try:
+        result, cache_status = await run_in_threadpool(
+            ws_manager.run_script, request.device_id, script, request.params,
+            request.use_cache, request.cache_ttl
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ScriptOutputError as e:
+        return json_response({
+            "success": False,
+            "error": str(e),
+            "output": e.output
+        }, accept_encoding)
+
+    if result is None:
+        return {
+            "success": False,
+            "error": "Command timeout or failed"
+        }
+
+    response = {
+        "success": True,
+        "device_id": request.device_id,
+        "script": script.name,
+        "os_family": result['os_family'],
+        "result": result['parsed']
+    }
+    if not request.lean:
+        response["output"] = result['output']
+    if cache_status:
+        response["cache"] = cache_status
+    return json_response(response, accept_encoding)
+
+
 class SaveJsonRequest(BaseModel):
-    device_id: str
+    device_id: Optional[str] = None
+    selector: Optional[str] = None  # Save on every online device matching it instead
     path: str  # Directory path on remote device
     data: Dict[str, Any]  # JSON data to save
 
@@ -429,6 +2840,10 @@ async def save_json(request: SaveJsonRequest, x_api_key: str = Header(None)):
     if not re.match(r'^[a-zA-Z0-9/_.\-]+$', request.path) or '..' in request.path:
         raise HTTPException(status_code=400, detail="Invalid path: only alphanumeric, /, _, -, . allowed")
 
+    require_one_target(request.device_id, request.selector)
+    if request.selector is None:
+        require_online_device(request.device_id)
+
     from datetime import datetime
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     filename = f"data_{timestamp}.json"
@@ -440,7 +2855,23 @@ async def save_json(request: SaveJsonRequest, x_api_key: str = Header(None)):
     json_b64 = base64.b64encode(json.dumps(request.data).encode()).decode()
     command = f"mkdir -p {safe_dir} && echo {shlex.quote(json_b64)} | base64 -d > {safe_filepath}"
 
-    result = ws_manager.execute_command(request.device_id, command)
+    # File writes are background work and must not delay interactive requests
+    if request.selector is not None:
+        node_ids = select_devices(request.selector, online_only=True)
+        replies = await run_in_threadpool(ws_manager.execute_command_many, node_ids, command, 0, 'bulk')
+        saved = [node_id for node_id, reply in replies.items() if reply is not None]
+        return {
+            "success": True,
+            "selector": request.selector,
+            "matched": len(node_ids),
+            "saved": saved,
+            "failed": [node_id for node_id, reply in replies.items() if reply is None],
+            "filepath": filepath,
+            "filename": filename,
+            "timestamp": timestamp
+        }
+
+    result = await run_in_threadpool(ws_manager.execute_command, request.device_id, command, 0, 'bulk')
 
     if result:
         return {
@@ -459,5 +2890,21 @@ async def save_json(request: SaveJsonRequest, x_api_key: str = Header(None)):
 
 if __name__ == "__main__":
     import uvicorn
+
+    class DrainingServer(uvicorn.Server):
+        """Drains on the first SIGTERM before uvicorn closes its listener
+
+        Lifespan shutdown only runs once the listener is closed, too late
+        for /health to report the drain. start_drain sends SIGTERM again
+        once drained, and that one (or a second one from outside) shuts
+        down as usual.
+        """
+
+        def handle_exit(self, sig, frame):
+            if sig == signal.SIGTERM and not drain_controller.draining:
+                if start_drain('SIGTERM', exit_after=True):
+                    return
+            super().handle_exit(sig, frame)
+
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    DrainingServer(uvicorn.Config(app, host="0.0.0.0", port=port)).run()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Device selector grammar and the inverted index that resolves it
+
+Shared by the proxy (app.py) and the bulk scripting CLI
+(meshcentral_client.py) so both accept exactly the same selectors.
+
+A selector is a list of whitespace-separated field:value terms, all of
+which must match. Commas separate alternatives within a term, a leading
+'-' excludes matches and values may be quoted shell-style. Fields:
+    mesh   device group name or id      os     OS family or osdesc word
+    state  online / offline             ip     address prefix or CIDR
+    tag    MeshCentral tag              name   device name
+    id     node id
+Example: 'mesh:swarm os:ubuntu state:online -tag:maintenance'
+"""
+
+import functools
+import ipaddress
+import re
+import shlex
+import threading
+from typing import Optional, Dict, List, Any, Tuple
+
+FIELDS = ('mesh', 'os', 'state', 'ip', 'tag', 'name', 'id')
+
+OS_TOKEN = re.compile(r'[a-z]{3,}')
+
+
+def os_family(os_desc: Optional[str]) -> str:
+    """Map a MeshCentral osdesc to 'windows', 'macos' or 'linux'"""
+    desc = (os_desc or '').lower()
+    if 'windows' in desc:
+        return 'windows'
+    if 'mac' in desc or 'darwin' in desc or 'os x' in desc:
+        return 'macos'
+    return 'linux'
+
+
+@functools.lru_cache(maxsize=1024)
+def os_keys(os_desc: Optional[str]) -> Tuple[str, ...]:
+    """OS family plus the words of an osdesc, as indexed by DeviceIndex"""
+    return (os_family(os_desc),) + tuple(set(OS_TOKEN.findall((os_desc or '').lower())))
+
+
+def parse_selector(selector: str) -> List[Tuple[bool, str, List[str]]]:
+    """Split a selector into (negate, field, alternatives) terms
+
+    Raises ValueError for bad syntax, so callers can reject a selector
+    before any device list is available.
+    """
+    try:
+        words = shlex.split(selector)
+    except ValueError as e:
+        raise ValueError(f"Invalid selector: {e}")
+    if not words:
+        raise ValueError("Empty selector")
+
+    terms = []
+    for word in words:
+        negate = word.startswith('-')
+        field, sep, values = word.lstrip('-').partition(':')
+        alternatives = [value for value in values.split(',') if value]
+        if not sep or field not in FIELDS or not alternatives:
+            raise ValueError(f"Invalid selector term '{word}', expected one of "
+                             f"{', '.join(FIELDS)} as field:value")
+        if field == 'ip':
+            for value in alternatives:
+                if '/' in value:
+                    try:
+                        ipaddress.ip_network(value, strict=False)
+                    except ValueError as e:
+                        raise ValueError(f"Invalid selector term '{word}': {e}")
+        terms.append((negate, field, alternatives))
+    return terms
+
+
+class DeviceIndex:
+    """Inverted index from device attributes to node ids, for selector queries"""
+
+    FIELDS = FIELDS
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[str, set]] = {field: {} for field in self.FIELDS}
+        self._ips: Dict[str, str] = {}
+        self._online: Dict[str, bool] = {}
+        self.all: set = set()
+
+    def rebuild(self, devices: Dict[str, Any], mesh_names: Dict[str, str]):
+        """Index a mesh-grouped MeshCentral device list from scratch"""
+        postings: Dict[str, Dict[str, set]] = {field: {} for field in self.FIELDS}
+        ips: Dict[str, str] = {}
+        online: Dict[str, bool] = {}
+
+        def add(field, value, node_id):
+            bucket = postings[field].get(value)
+            if bucket is None:
+                postings[field][value] = bucket = set()
+            bucket.add(node_id)
+
+        for mesh_id, devices_in_mesh in devices.items():
+            if not isinstance(devices_in_mesh, list):
+                continue
+            mesh_nodes = set()
+            for device in devices_in_mesh:
+                node_id = device.get('_id')
+                if not node_id:
+                    continue
+                mesh_nodes.add(node_id)
+
+                for value in os_keys(device.get('osdesc')):
+                    add('os', value, node_id)
+                is_online = (device.get('conn', 0) & 1) != 0
+                online[node_id] = is_online
+                add('state', 'online' if is_online else 'offline', node_id)
+                if device.get('name'):
+                    add('name', device['name'].lower(), node_id)
+                for tag in device.get('tags') or ():
+                    add('tag', str(tag).lower(), node_id)
+
+                ip = device.get('ip')
+                if ip and ip != 'N/A':
+                    ips[node_id] = ip
+                    if ':' in ip:
+                        add('ip', ip.lower(), node_id)
+                    else:
+                        prefix = ''
+                        for octet in ip.split('.'):
+                            prefix = f"{prefix}.{octet}" if prefix else octet
+                            add('ip', prefix, node_id)
+
+            # One shared posting per mesh, under its id, short id and name
+            mesh_values = {mesh_id, mesh_id.split('//', 1)[-1]}
+            if mesh_names.get(mesh_id):
+                mesh_values.add(mesh_names[mesh_id].lower())
+            for value in mesh_values:
+                postings['mesh'].setdefault(value, set()).update(mesh_nodes)
+
+        with self._lock:
+            self._postings = postings
+            self._ips = ips
+            self._online = online
+            self.all = set(online)
+
+    def set_online(self, node_id: str, online: bool):
+        """Move a device between state:online and state:offline"""
+        with self._lock:
+            if self._online.get(node_id, online) == online:
+                return
+            self._online[node_id] = online
+            new, old = ('online', 'offline') if online else ('offline', 'online')
+            self._postings['state'].get(old, set()).discard(node_id)
+            self._postings['state'].setdefault(new, set()).add(node_id)
+
+    def _match(self, field: str, value: str) -> List[set]:
+        """Sets of node ids matching one field:value; caller holds the lock
+
+        The sets may be index postings and must not be modified.
+        """
+        if field == 'id':
+            return [{value}] if value in self._online else []
+        postings = self._postings[field]
+        if field == 'ip' and '/' in value:
+            network = ipaddress.ip_network(value, strict=False)
+            if network.version == 6:
+                return [{node_id for node_id, ip in self._ips.items()
+                         if ':' in ip and ipaddress.ip_address(ip) in network}]
+            if network.prefixlen == 0:
+                return [self.all]
+            # A CIDR is the union of the octet prefixes it covers, e.g. /23 is two /24s
+            octets = -(-network.prefixlen // 8)
+            subnets = network.subnets(new_prefix=octets * 8) if network.prefixlen % 8 else [network]
+            prefixes = ('.'.join(str(subnet.network_address).split('.')[:octets]) for subnet in subnets)
+            return [postings[prefix] for prefix in prefixes if prefix in postings]
+        if field == 'ip':
+            value = value.rstrip('.')
+        match = postings.get(value) or postings.get(value.lower())
+        return [match] if match else []
+
+    def resolve(self, selector: str, online_only: bool = False) -> set:
+        """Node ids matching a selector; raises ValueError for bad syntax"""
+        terms = parse_selector(selector)
+
+        include: List[set] = []
+        exclude: List[set] = []
+        with self._lock:
+            for negate, field, values in terms:
+                alternatives = [match for value in values for match in self._match(field, value)]
+                (exclude if negate else include).append(alternatives)
+
+            if online_only:
+                include.append([self._postings['state'].get('online', set())])
+            if not include:
+                include.append([self.all])
+
+            # Start from the smallest term so every step only shrinks the result;
+            # alternatives of later terms are checked per node, never unioned
+            include.sort(key=lambda alternatives: sum(map(len, alternatives)))
+            result = set().union(*include[0])
+            for alternatives in include[1:]:
+                if len(alternatives) == 1:
+                    result.intersection_update(alternatives[0])
+                else:
+                    result = {node_id for node_id in result if any(node_id in alt for alt in alternatives)}
+            for alternatives in exclude:
+                result.difference_update(*alternatives)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'devices': len(self.all),
+                'keys': {field: len(postings) for field, postings in self._postings.items() if field != 'id'}
+            }
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Replay recorded MeshCentral traffic against the proxy
+
+Set TRAFFIC_RECORD_PATH on a running proxy to capture a recording. This
+script then starts a local fake MeshCentral server that answers the proxy the
+way the real server did, using the recorded replies, latencies and
+unsolicited events. It also drives the proxy's HTTP API with the recorded
+API requests, route by route with their original bodies, at 1x or
+accelerated speed. Outbound frames the proxy sent on its own (telemetry,
+device list refreshes) are answered but not turned into requests.
+
+Redacted values ("<redacted:N>") are replaced with filler of the same length,
+so the byte volume matches the original traffic.
+
+Usage:
+    python replay.py traffic.jsonl --spawn --speed 4 --output run-a.json
+    python replay.py traffic.jsonl --proxy-url http://localhost:8000 --api-key KEY --compare run-a.json
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import httpx
+import websockets
+
+REDACTED = re.compile(r'^<redacted:(\d+)>$')
+
+
+def load_recording(path: str) -> List[Tuple[float, str, Dict]]:
+    """Frames and API requests of a recording in order, without the meta line"""
+    frames = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                offset, direction, payload = json.loads(line)[:3]
+                if direction in ('in', 'out', 'http'):
+                    frames.append((offset, direction, payload))
+    # Outbound frames are written after the send, so a fast reply can be logged first
+    frames.sort(key=lambda frame: frame[0])
+    return frames
+
+
+def request_key(msg: Dict) -> Tuple:
+    """What a recorded reply is matched on when the proxy sends a request"""
+    nodes = msg.get('nodeids') or [msg.get('nodeid')]
+    return (msg.get('action'), msg.get('type'), tuple(nodes))
+
+
+def expand(value: Any, key: Optional[str] = None) -> Any:
+    """Replace redaction placeholders with filler of the recorded length"""
+    if isinstance(value, dict):
+        return {k: expand(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [expand(v) for v in value]
+    if isinstance(value, str):
+        match = REDACTED.match(value)
+        if match:
+            length = int(match.group(1))
+            # Screenshot data must stay decodable base64
+            return 'A' * (length - length % 4) if key == 'data' else 'x' * length
+    return value
+
+
+class Workload:
+    """A recording split into reply tables, unsolicited events and API requests
+
+    Replies are grouped per request message, so a multi-node runcommands
+    gets all of its per-node replies back.
+    """
+
+    def __init__(self, frames: List[Tuple[float, str, Dict]]):
+        self.replies: Dict[Tuple, Deque[List[Tuple[float, Dict]]]] = defaultdict(deque)
+        self.replies_by_action: Dict[str, Deque[List[Tuple[float, Dict]]]] = defaultdict(deque)
+        self.events: List[Tuple[float, Dict]] = []
+        self.requests: List[Tuple[float, Dict]] = []
+
+        by_id: Dict[str, Tuple[float, Dict, Optional[List]]] = {}
+        by_action: Dict[str, Deque[Tuple[float, Dict]]] = defaultdict(deque)
+
+        for offset, direction, payload in frames:
+            if direction == 'http':
+                self.requests.append((offset, payload))
+                continue
+            if direction == 'out':
+                if 'responseid' in payload:
+                    by_id[payload['responseid']] = (offset, payload, None)
+                else:
+                    by_action[payload.get('action')].append((offset, payload))
+                continue
+
+            responseid = payload.get('responseid')
+            if responseid in by_id:
+                sent_at, msg, group = by_id[responseid]
+                if group is None:
+                    group = []
+                    by_id[responseid] = (sent_at, msg, group)
+                    self.replies[request_key(msg)].append(group)
+                    self.replies_by_action[msg.get('action')].append(group)
+                group.append((offset - sent_at, payload))
+            elif by_action[payload.get('action')]:
+                sent_at, msg = by_action[payload.get('action')].popleft()
+                group = [(offset - sent_at, payload)]
+                self.replies[request_key(msg)].append(group)
+                self.replies_by_action[msg.get('action')].append(group)
+            else:
+                self.events.append((offset, payload))
+
+    def replies_for(self, msg: Dict) -> Optional[List[Tuple[float, Dict]]]:
+        """Next recorded replies for a request, falling back to any of the same action"""
+        for table, key in ((self.replies, request_key(msg)), (self.replies_by_action, msg.get('action'))):
+            groups = table.get(key)
+            if groups:
+                group = groups[0]
+                # Keep the last group around for requests beyond the recording
+                if len(groups) > 1:
+                    groups.popleft()
+                return group
+        return None
+
+
+class Timeline:
+    """Maps recording offsets to wall time for both events and HTTP requests
+
+    The origin is the offset of the first recorded request and the clock
+    starts once the proxy is ready, so events keep their place relative to
+    the workload. Anything recorded before the origin goes out at the start.
+    """
+
+    def __init__(self, origin: float, speed: float):
+        self.origin = origin
+        self.speed = speed
+        self.started_at: Optional[float] = None
+        self._started = asyncio.Event()
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._started.set()
+
+    async def wait_until(self, offset: float):
+        await self._started.wait()
+        delay = (offset - self.origin) / self.speed - (time.monotonic() - self.started_at)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class FakeMeshCentral:
+    """WebSocket server that plays a workload's server side"""
+
+    def __init__(self, workload: Workload, timeline: Timeline):
+        self.workload = workload
+        self.timeline = timeline
+        self.frames_in = 0
+        self.frames_out = 0
+        self.unanswered = 0
+
+    async def handler(self, ws):
+        events = asyncio.create_task(self._push_events(ws))
+        try:
+            async for raw in ws:
+                self.frames_in += 1
+                asyncio.create_task(self._answer(ws, json.loads(raw)))
+        finally:
+            events.cancel()
+
+    async def _push_events(self, ws):
+        for offset, event in self.workload.events:
+            await self.timeline.wait_until(offset)
+            await ws.send(json.dumps(expand(event)))
+            self.frames_out += 1
+
+    async def _answer(self, ws, msg: Dict):
+        group = self.workload.replies_for(msg)
+        if group is None:
+            self.unanswered += 1
+            return
+        started = time.monotonic()
+        nodes = msg.get('nodeids') or [msg.get('nodeid')]
+        recorded_nodes = {reply.get('nodeid') for _, reply in group}
+        unused = [node for node in nodes if node not in recorded_nodes]
+        for latency, reply in sorted(group, key=lambda item: item[0]):
+            delay = latency / self.timeline.speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            reply = expand(copy.deepcopy(reply))
+            if 'responseid' in msg:
+                reply['responseid'] = msg['responseid']
+            else:
+                reply.pop('responseid', None)
+            # The replayed batch may address other nodes than the recorded one
+            if 'nodeid' in reply and reply['nodeid'] not in nodes and unused:
+                reply['nodeid'] = unused.pop(0)
+            await ws.send(json.dumps(reply))
+            self.frames_out += 1
+
+
+async def wait_for_proxy(client: httpx.AsyncClient, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            health = (await client.get('/health')).json()
+            if health.get('authenticated'):
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("Proxy did not connect to the fake MeshCentral server")
+
+
+async def drive(client: httpx.AsyncClient, requests: List[Tuple[float, Dict]], timeline: Timeline,
+                api_key: str) -> List[Dict[str, Any]]:
+    """Issue the recorded API requests on their original (scaled) timeline"""
+    results = []
+    headers = {'X-API-Key': api_key}
+
+    async def issue(offset: float, request: Dict):
+        await timeline.wait_until(offset)
+
+        endpoint = request['path']
+        url = f"{endpoint}?{request['query']}" if request.get('query') else endpoint
+        body = expand(request.get('body'))
+
+        sent = time.monotonic()
+        try:
+            response = await client.request(request['method'], url, headers=headers,
+                                            json=body)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        results.append({
+            'endpoint': endpoint,
+            'status': status,
+            'latency_ms': (time.monotonic() - sent) * 1000
+        })
+
+    await asyncio.gather(*(issue(offset, request) for offset, request in requests))
+    return results
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(results: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    by_endpoint = defaultdict(list)
+    for result in results:
+        by_endpoint[result['endpoint']].append(result)
+
+    summary = {'wall_seconds': round(wall_seconds, 2), 'endpoints': {}}
+    for endpoint, items in sorted(by_endpoint.items()):
+        latencies = [item['latency_ms'] for item in items]
+        summary['endpoints'][endpoint] = {
+            'count': len(items),
+            'errors': sum(1 for item in items if item['status'] != 200),
+            'p50_ms': round(percentile(latencies, 0.50), 1),
+            'p95_ms': round(percentile(latencies, 0.95), 1),
+            'p99_ms': round(percentile(latencies, 0.99), 1),
+            'max_ms': round(max(latencies), 1)
+        }
+    return summary
+
+
+def print_summary(summary: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    print(f"\nReplay finished in {summary['wall_seconds']}s")
+    for endpoint, stats in summary['endpoints'].items():
+        line = (f"  {endpoint}: {stats['count']} requests, {stats['errors']} errors, "
+                f"p50 {stats['p50_ms']}ms, p95 {stats['p95_ms']}ms, p99 {stats['p99_ms']}ms")
+        base = (baseline or {}).get('endpoints', {}).get(endpoint)
+        if base:
+            line += f" (p50 {stats['p50_ms'] - base['p50_ms']:+.1f}ms, p95 {stats['p95_ms'] - base['p95_ms']:+.1f}ms vs baseline)"
+        print(line)
+
+
+async def replay(args) -> Dict[str, Any]:
+    workload = Workload(load_recording(args.recording))
+    print(f"Loaded {len(workload.requests)} HTTP requests and {len(workload.events)} events")
+    if not workload.requests:
+        print("No API requests in the recording; it may predate request recording")
+
+    timeline = Timeline(workload.requests[0][0] if workload.requests else 0.0, args.speed)
+    server = FakeMeshCentral(workload, timeline)
+    proxy = None
+    async with websockets.serve(server.handler, '127.0.0.1', args.server_port, max_size=None):
+        proxy_url = args.proxy_url
+        if args.spawn:
+            env = dict(os.environ,
+                       DAISYCHAIN_URL=f'ws://127.0.0.1:{args.server_port}/control.ashx',
+                       MESHCENTRAL_USERNAME='replay', MESHCENTRAL_PASSWORD='replay',
+                       PROXY_API_KEY=args.api_key, PORT=str(args.proxy_port))
+            env.pop('TRAFFIC_RECORD_PATH', None)
+            proxy = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__), 'app.py')], env=env)
+            proxy_url = f'http://127.0.0.1:{args.proxy_port}'
+
+        try:
+            async with httpx.AsyncClient(base_url=proxy_url, timeout=None) as client:
+                await wait_for_proxy(client)
+                timeline.start()
+                started = time.monotonic()
+                results = await drive(client, workload.requests, timeline, args.api_key)
+                summary = summarize(results, time.monotonic() - started)
+        finally:
+            if proxy is not None:
+                proxy.terminate()
+                proxy.wait()
+
+    summary['speed'] = args.speed
+    summary['fake_server'] = {
+        'frames_in': server.frames_in,
+        'frames_out': server.frames_out,
+        'unanswered': server.unanswered
+    }
+    return summary
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay a TRAFFIC_RECORD_PATH recording against the proxy")
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=float, default=1.0, help="Time compression factor, e.g. 4 = 4x faster")
+    parser.add_argument('--server-port', type=int, default=8765, help="Port of the fake MeshCentral server")
+    parser.add_argument('--spawn', action='store_true', help="Start app.py pointed at the fake server")
+    parser.add_argument('--proxy-port', type=int, default=8001, help="Port for the spawned proxy")
+    parser.add_argument('--proxy-url', default='http://127.0.0.1:8000',
+                        help="Already running proxy (its DAISYCHAIN_URL must point at the fake server)")
+    parser.add_argument('--api-key', default=os.getenv('PROXY_API_KEY', 'replay'))
+    parser.add_argument('--output', help="Write the summary as JSON")
+    parser.add_argument('--compare', help="Summary JSON of an earlier run to diff against")
+    args = parser.parse_args(argv)
+
+    summary = asyncio.run(replay(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    print_summary(summary, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('pymongo')
+from pymongo import DeleteOne, InsertOne, ReplaceOne  # noqa: E402
+from pymongo.errors import AutoReconnect  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import nedb_import  # noqa: E402
+
+
+class FlakyCollection:
+    """Collection whose bulk_write raises on the given call numbers"""
+
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.calls = 0
+        self.written = []
+
+    def bulk_write(self, ops, ordered=True):
+        self.calls += 1
+        if self.calls in self.fail_on:
+            raise AutoReconnect("connection reset")
+        self.written.extend(op._filter['_id'] for op in ops)
+
+
+def write_records(path, count):
+    with open(path, 'w') as f:
+        for i in range(count):
+            f.write(json.dumps({'_id': f'doc{i}', 'n': i}) + '\n')
+
+
+def test_failed_last_batch_is_not_checkpointed(tmp_path):
+    source = str(tmp_path / 'records.jsonl')
+    write_records(source, 25)
+    checkpoint = nedb_import.Checkpoint(str(tmp_path / 'checkpoint.json'))
+    collection = FlakyCollection(fail_on={3})
+
+    with pytest.raises(AutoReconnect):
+        nedb_import.import_file(collection, source, batch_size=10, checkpoint=checkpoint)
+
+    assert len(collection.written) == 20
+    assert nedb_import.Checkpoint(checkpoint.path).resume_point(source) == 20
+
+
+def test_failed_middle_batch_holds_back_checkpoint(tmp_path):
+    source = str(tmp_path / 'records.jsonl')
+    write_records(source, 25)
+    checkpoint = nedb_import.Checkpoint(str(tmp_path / 'checkpoint.json'))
+    collection = FlakyCollection(fail_on={2})
+
+    with pytest.raises(AutoReconnect):
+        nedb_import.import_file(collection, source, batch_size=10, checkpoint=checkpoint)
+
+    assert nedb_import.Checkpoint(checkpoint.path).resume_point(source) <= 10
+
+
+class UnorderedCollection:
+    """Applies a bulk write the way pymongo's unordered bulk does: by type"""
+
+    def __init__(self):
+        self.docs = {}
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            if isinstance(op, InsertOne):
+                self.docs[op._doc['_id']] = op._doc
+        for op in ops:
+            if isinstance(op, ReplaceOne):
+                self.docs[op._filter['_id']] = op._doc
+        for op in ops:
+            if isinstance(op, DeleteOne):
+                self.docs.pop(op._filter['_id'], None)
+
+def test_last_record_per_id_wins_within_a_batch(tmp_path):
+    source = str(tmp_path / 'records.jsonl')
+    with open(source, 'w') as f:
+        for record in ({'_id': 'x', 'v': 1}, {'_id': 'x', 'v': 2},
+                       {'_id': 'x', '$$deleted': True}, {'_id': 'x', 'v': 3},
+                       {'_id': 'y', 'v': 1}, {'_id': 'y', '$$deleted': True}):
+            f.write(json.dumps(record) + '\n')
+    collection = UnorderedCollection()
+
+    nedb_import.import_file(collection, source, batch_size=10)
+
+    assert collection.docs == {'x': {'_id': 'x', 'v': 3}}
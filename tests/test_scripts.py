@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('websocket')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxy'))
+import app  # noqa: E402
+
+MACOS_DF = """\
+Filesystem     1024-blocks      Used Available Capacity  Mounted on
+/dev/disk3s1s1   482797652  10128136 260213476     4%    /
+devfs                  199       199         0   100%    /dev
+/dev/disk3s6     482797652   2097172 260213476     1%    /System/Volumes/VM
+/dev/disk3s5     482797652 208467344 260213476    45%    /System/Volumes/Data
+map auto_home            0         0         0   100%    /System/Volumes/Data/home
+/dev/disk2s1       5242880   1832536   3390052    36%    /Volumes/My Disk
+"""
+
+LINUX_DF = """\
+Filesystem     1024-blocks     Used Available Capacity Mounted on
+udev               8123456        0   8123456       0% /dev
+/dev/nvme0n1p2   490617784 98765432 366851016      22% /
+"""
+
+MACOS_BOOTTIME = "{ sec = 1700000000, usec = 123456 } Tue Nov 14 22:13:20 2023"
+
+
+def test_df_macos_rows_with_spaces():
+    disks = {disk['mount']: disk for disk in app._parse_df(MACOS_DF)['disks']}
+
+    assert disks['/System/Volumes/Data/home']['filesystem'] == 'map auto_home'
+    assert disks['/System/Volumes/Data/home']['size_bytes'] == 0
+    assert disks['/Volumes/My Disk']['used_bytes'] == 1832536 * 1024
+    assert disks['/']['free_bytes'] == 260213476 * 1024
+    assert len(disks) == 6
+
+
+def test_df_linux():
+    disks = app._parse_df(LINUX_DF)['disks']
+
+    assert [disk['mount'] for disk in disks] == ['/dev', '/']
+    assert disks[1]['size_bytes'] == 490617784 * 1024
+
+
+def test_df_skips_unparseable_rows():
+    output = LINUX_DF + "broken row without capacity\nweird x y z 10% /mnt\n"
+
+    assert [disk['mount'] for disk in app._parse_df(output)['disks']] == ['/dev', '/']
+
+
+def test_macos_uptime_uses_boot_seconds_not_usec():
+    _, command, parser = app.SCRIPT_REGISTRY['uptime'].render('macos', {})
+    command = command.replace('sysctl -n kern.boottime', f"echo '{MACOS_BOOTTIME}'")
+
+    output = subprocess.run(['sh', '-c', command], capture_output=True, text=True, check=True).stdout
+    uptime = parser(output)['uptime_seconds']
+
+    assert abs(uptime - (time.time() - 1700000000)) < 5
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Content-hash verifier for NeDB/JSONL exports migrated into MongoDB
+
+Matching document counts don't prove the data matches. This script streams
+the source exports and the target collection at the same time. Each
+document's canonical JSON is hashed, and the results are compared per _id.
+Missing, extra and differing ids are reported, together with an
+order-independent rolling hash per record type for each side.
+
+Memory stays bounded: both sides are spilled to hash-partitioned bucket files
+in a temporary directory, and the buckets are compared one at a time in
+parallel worker processes.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from nedb_import import iter_documents, MONGO_URL, DB_NAME, COLLECTION_NAME, DEFAULT_FILES
+
+try:
+    from pymongo import MongoClient
+except ImportError:
+    MongoClient = None
+
+DELETED = '-'
+HASH_MODULUS = 1 << 128
+
+
+def document_digest(doc: Dict[str, Any]) -> str:
+    """Hash of a document's canonical JSON form"""
+    canonical = json.dumps(doc, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def bucket_for(doc_id: str, buckets: int) -> int:
+    return zlib.crc32(doc_id.encode('utf-8')) % buckets
+
+
+class BucketWriter:
+    """Spills (id, type, digest) lines to one file per bucket"""
+
+    def __init__(self, directory: str, side: str, buckets: int):
+        self.buckets = buckets
+        self.paths = [os.path.join(directory, f"{side}-{i:04d}.tsv") for i in range(buckets)]
+        self.files = [open(path, 'w', encoding='utf-8', buffering=1 << 16) for path in self.paths]
+        self.count = 0
+
+    def add(self, doc: Dict[str, Any]):
+        doc_id = str(doc.get('_id'))
+        if doc.get('$$deleted'):
+            digest, doc_type = DELETED, ''
+        else:
+            digest, doc_type = document_digest(doc), str(doc.get('type', ''))
+        # json.dumps escapes tabs and newlines, keeping one record per line
+        self.files[bucket_for(doc_id, self.buckets)].write(
+            f"{digest}\t{json.dumps(doc_type)}\t{json.dumps(doc_id)}\n"
+        )
+        self.count += 1
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+
+def scan_source(paths: List[str], writer: BucketWriter, types: Optional[set]):
+    """Stream the exports into source buckets; later records for an _id win"""
+    for path in paths:
+        for doc in iter_documents(path):
+            if '_id' not in doc:
+                continue
+            if types and not doc.get('$$deleted') and doc.get('type') not in types:
+                continue
+            writer.add(doc)
+
+
+def scan_target(documents: Iterable[Dict[str, Any]], writer: BucketWriter):
+    """Stream the target collection into target buckets"""
+    for doc in documents:
+        writer.add(doc)
+
+
+def load_bucket(path: str) -> Dict[str, Tuple[str, str]]:
+    """Final id -> (type, digest) state of one bucket file"""
+    entries: Dict[str, Tuple[str, str]] = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            digest, doc_type, doc_id = line.rstrip('\n').split('\t', 2)
+            doc_id = json.loads(doc_id)
+            if digest == DELETED:
+                entries.pop(doc_id, None)
+            else:
+                entries[doc_id] = (json.loads(doc_type), digest)
+    return entries
+
+
+def compare_bucket(source_path: str, target_path: str, sample_limit: int) -> Dict[str, Any]:
+    """Compare one bucket pair, returning counts, samples and per-type hashes"""
+    source = load_bucket(source_path)
+    target = load_bucket(target_path)
+
+    result = {
+        'source_count': len(source),
+        'target_count': len(target),
+        'missing': [], 'extra': [], 'differing': [],
+        'missing_count': 0, 'extra_count': 0, 'differing_count': 0,
+        'by_type': {}
+    }
+
+    def type_entry(doc_type: str) -> Dict[str, int]:
+        if doc_type not in result['by_type']:
+            result['by_type'][doc_type] = {
+                'source_count': 0, 'target_count': 0, 'source_hash': 0, 'target_hash': 0,
+                'missing': 0, 'extra': 0, 'differing': 0
+            }
+        return result['by_type'][doc_type]
+
+    for doc_id, (doc_type, digest) in source.items():
+        entry = type_entry(doc_type)
+        entry['source_count'] += 1
+        entry['source_hash'] = (entry['source_hash'] + int(digest, 16)) % HASH_MODULUS
+
+        other = target.get(doc_id)
+        if other is None:
+            entry['missing'] += 1
+            result['missing_count'] += 1
+            if len(result['missing']) < sample_limit:
+                result['missing'].append(doc_id)
+        elif other[1] != digest:
+            entry['differing'] += 1
+            result['differing_count'] += 1
+            if len(result['differing']) < sample_limit:
+                result['differing'].append(doc_id)
+
+    for doc_id, (doc_type, digest) in target.items():
+        entry = type_entry(doc_type)
+        entry['target_count'] += 1
+        entry['target_hash'] = (entry['target_hash'] + int(digest, 16)) % HASH_MODULUS
+        if doc_id not in source:
+            entry['extra'] += 1
+            result['extra_count'] += 1
+            if len(result['extra']) < sample_limit:
+                result['extra'].append(doc_id)
+
+    return result
+
+
+def merge_results(results: Iterable[Dict[str, Any]], sample_limit: int) -> Dict[str, Any]:
+    """Combine per-bucket results into one report"""
+    report = {
+        'source_count': 0, 'target_count': 0,
+        'missing_count': 0, 'extra_count': 0, 'differing_count': 0,
+        'missing': [], 'extra': [], 'differing': [],
+        'by_type': {}
+    }
+    for result in results:
+        for key in ('source_count', 'target_count', 'missing_count', 'extra_count', 'differing_count'):
+            report[key] += result[key]
+        for key in ('missing', 'extra', 'differing'):
+            report[key].extend(result[key][:sample_limit - len(report[key])])
+        for doc_type, entry in result['by_type'].items():
+            merged = report['by_type'].setdefault(doc_type, {
+                'source_count': 0, 'target_count': 0, 'source_hash': 0, 'target_hash': 0,
+                'missing': 0, 'extra': 0, 'differing': 0
+            })
+            for key, value in entry.items():
+                if key.endswith('_hash'):
+                    merged[key] = (merged[key] + value) % HASH_MODULUS
+                else:
+                    merged[key] += value
+
+    for entry in report['by_type'].values():
+        entry['match'] = entry['source_hash'] == entry['target_hash']
+        entry['source_hash'] = f"{entry['source_hash']:032x}"
+        entry['target_hash'] = f"{entry['target_hash']:032x}"
+
+    report['match'] = not (report['missing_count'] or report['extra_count'] or report['differing_count'])
+    return report
+
+
+def verify(source_paths: List[str], target_documents: Iterable[Dict[str, Any]],
+           buckets: int = 256, workers: int = 4, sample_limit: int = 20,
+           types: Optional[set] = None, work_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Verify that target_documents match the source exports
+
+    target_documents is any iterable of documents, e.g. a pymongo cursor or
+    the documents of an in-memory collection.
+    """
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory(prefix='verify-', dir=work_dir) as directory:
+        source_writer = BucketWriter(directory, 'source', buckets)
+        target_writer = BucketWriter(directory, 'target', buckets)
+        errors: List[BaseException] = []
+
+        def run(fn, *args):
+            try:
+                fn(*args)
+            except BaseException as e:
+                errors.append(e)
+
+        # Both sides are read at the same time; the target is mostly network bound
+        source_thread = threading.Thread(target=run, args=(scan_source, source_paths, source_writer, types))
+        source_thread.start()
+        run(scan_target, target_documents, target_writer)
+        source_thread.join()
+        source_writer.close()
+        target_writer.close()
+        if errors:
+            raise errors[0]
+        scanned = time.monotonic()
+
+        pairs = list(zip(source_writer.paths, target_writer.paths))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(compare_bucket, *zip(*pairs), [sample_limit] * len(pairs)))
+        else:
+            results = [compare_bucket(source, target, sample_limit) for source, target in pairs]
+
+    report = merge_results(results, sample_limit)
+    report['seconds'] = {
+        'scan': round(scanned - started, 2),
+        'compare': round(time.monotonic() - scanned, 2)
+    }
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    """Human-readable diff summary"""
+    print(f"\nSource documents: {report['source_count']}")
+    print(f"Target documents: {report['target_count']}")
+    print(f"Missing in target: {report['missing_count']}")
+    print(f"Extra in target:   {report['extra_count']}")
+    print(f"Differing content: {report['differing_count']}")
+
+    print("\nBy type:")
+    for doc_type, entry in sorted(report['by_type'].items()):
+        status = "OK" if entry['match'] else "MISMATCH"
+        print(f"  {doc_type or '(none)'}: {status} source={entry['source_count']} target={entry['target_count']} "
+              f"missing={entry['missing']} extra={entry['extra']} differing={entry['differing']}")
+
+    for key in ('missing', 'extra', 'differing'):
+        if report[key]:
+            print(f"\nSample {key} _ids:")
+            for doc_id in report[key]:
+                print(f"  {doc_id}")
+
+    print(f"\nScan: {report['seconds']['scan']}s, compare: {report['seconds']['compare']}s")
+    print("\nVerification passed" if report['match'] else "\nVerification FAILED")
+
+
+def main(argv: Optional[List[str]] = None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Verify migrated MeshCentral data by content hash")
+    parser.add_argument('files', nargs='*', default=DEFAULT_FILES,
+                        help="NeDB datafiles or JSON/JSONL exports (default: %(default)s)")
+    parser.add_argument('--mongo-url', default=MONGO_URL, help="MongoDB connection string (default: $MONGO_URL)")
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--collection', default=COLLECTION_NAME)
+    parser.add_argument('--types', help="Comma-separated record types to compare, e.g. user,mesh")
+    parser.add_argument('--buckets', type=int, default=256, help="Partitions spilled to disk")
+    parser.add_argument('--workers', type=int, default=4, help="Processes comparing buckets")
+    parser.add_argument('--samples', type=int, default=20, help="Ids listed per category")
+    parser.add_argument('--work-dir', help="Where bucket files go (default: system temp)")
+    parser.add_argument('--json', dest='json_path', help="Also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    if not args.mongo_url:
+        parser.error("Set MONGO_URL or pass --mongo-url")
+
+    if MongoClient is None:
+        print("pymongo not installed. Install with: pip install pymongo")
+        sys.exit(1)
+
+    types = set(args.types.split(',')) if args.types else None
+    client = MongoClient(args.mongo_url)
+    try:
+        collection = client[args.db][args.collection]
+        query = {'type': {'$in': sorted(types)}} if types else {}
+        cursor = collection.find(query, batch_size=5000)
+
+        report = verify(args.files, cursor, buckets=args.buckets, workers=args.workers,
+                        sample_limit=args.samples, types=types, work_dir=args.work_dir)
+    finally:
+        client.close()
+
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(0 if report['match'] else 1)
+
+
+if __name__ == "__main__":
+    main()